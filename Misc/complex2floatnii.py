@@ -1,41 +1,147 @@
 #!/usr/bin/env python3
 """
-Convert complex NIfTI images (DT=1792 / COMPLEX128) into real-valued
-magnitude images (FLOAT32) that can be used in FSL.
+Convert complex NIfTI images (DT=1792 / COMPLEX128, or COMPLEX64) into
+real-valued magnitude images (FLOAT32) that can be used in FSL.
+
+The image is streamed: one z-slab of one volume is read from disk at a
+time, its magnitude (and optionally phase) computed directly into a
+float32 buffer, and appended to the output file. Memory use is a few
+slabs regardless of image size, so large 4D / multi-echo series are fine.
+
+Inputs can be a file, a directory (all complex .nii/.nii.gz in it) or a
+glob. A single real-valued file is converted to abs(data), as before;
+directories and globs only pick up complex images. Several inputs are
+converted in parallel (--jobs). For a single file, the second argument
+is the output file; otherwise it is the output directory (default: next
+to each input, as <name>_mag.nii.gz).
 
 Usage:
-    python convert_complex_to_float.py input.nii output.nii
+    python complex2floatnii.py input.nii output.nii
+    python complex2floatnii.py input.nii output.nii --phase output_phase.nii
+    python complex2floatnii.py /data/session01 /data/session01/mag --phase --jobs 8
+    python complex2floatnii.py "/data/*/echo*.nii.gz" --phase
 """
 
+import os
 import sys
-import nibabel as nib
+import glob
+import itertools
+import argparse
+from contextlib import ExitStack
 import numpy as np
+import nibabel as nib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PET", "pet_suvr"))
+from nifti_stream import SlabWriter  # noqa: E402
+
+
+def is_complex(path):
+    try:
+        return nib.load(path).get_data_dtype().kind == 'c'
+    except Exception:
+        return False
 
-def convert_complex_to_float(input_file, output_file):
-    # Load the input image
-    img = nib.load(input_file)
 
-    # Force nibabel to interpret voxels as complex128
-    data = img.get_fdata(dtype=np.complex128)
+def convert_complex_to_float(input_file, output_file, phase_file=None, slab=16):
+    """Write the magnitude (and optionally phase, radians) of a complex image.
 
-    # Compute magnitude
-    mag = np.abs(data)
+    Real-valued input is accepted too: its magnitude is abs(data) and its
+    phase 0 or pi, as before.
+    """
+    img = nib.load(input_file)
+    if img.get_data_dtype().kind != 'c':
+        print(f"Note: {input_file} is not complex ({img.get_data_dtype()}); writing abs(data)")
+    shape = img.shape
+    prox = img.dataobj
+    nz = shape[2] if len(shape) > 2 else 1
 
-    # Make a new NIfTI image with same orientation/affine
-    out_img = nib.Nifti1Image(mag.astype(np.float32), img.affine, img.header)
+    def blocks():
+        # NIfTI is x-fastest: z-slabs of volume 0, then volume 1, ...
+        if len(shape) == 2:
+            yield np.asarray(prox[:, :])[:, :, None]
+            return
+        for vol in itertools.product(*(range(n) for n in shape[3:])):
+            for z0 in range(0, nz, slab):
+                z1 = min(z0 + slab, nz)
+                yield np.asarray(prox[(slice(None), slice(None), slice(z0, z1)) + vol])
 
-    # Explicitly set header datatype to FLOAT32
-    out_img.header.set_data_dtype(np.float32)
+    with ExitStack() as stack:
+        mag_w = stack.enter_context(SlabWriter(output_file, img.affine, img.header, shape))
+        pha_w = stack.enter_context(SlabWriter(phase_file, img.affine, img.header, shape)) if phase_file else None
+        for block in blocks():
+            out = np.empty(block.shape, dtype=np.float32)
+            if block.dtype.kind == 'c':
+                np.hypot(block.real, block.imag, out=out, casting='same_kind')
+            else:
+                np.abs(block, out=out, casting='same_kind')
+            mag_w.write(out)
+            if pha_w:
+                np.arctan2(np.imag(block), np.real(block), out=out, casting='same_kind')
+                pha_w.write(out)
 
-    # Save
-    nib.save(out_img, output_file)
     print(f"Saved FLOAT32 magnitude image to: {output_file}")
+    if phase_file:
+        print(f"Saved FLOAT32 phase image to: {phase_file}")
+    return output_file
+
+
+def expand_inputs(pattern):
+    """Complex NIfTI files named by a file, directory or glob."""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, f) for f in sorted(os.listdir(pattern))
+                 if f.endswith((".nii", ".nii.gz"))]
+        return [p for p in paths if is_complex(p)]
+    if os.path.isfile(pattern):
+        return [pattern]
+    return [p for p in sorted(glob.glob(pattern)) if is_complex(p)]
+
+
+def output_names(path, outdir, phase):
+    stem = os.path.basename(path).replace(".nii.gz", "").replace(".nii", "")
+    outdir = outdir or os.path.dirname(os.path.abspath(path))
+    mag = os.path.join(outdir, f"{stem}_mag.nii.gz")
+    return mag, (os.path.join(outdir, f"{stem}_phase.nii.gz") if phase else None)
+
+
+def _convert_one(job):
+    src, mag, pha, slab = job
+    try:
+        return convert_complex_to_float(src, mag, pha, slab), None
+    except Exception as e:
+        return src, str(e)
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python convert_complex_to_float.py input.nii output.nii")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Complex NIfTI to FLOAT32 magnitude (and phase)")
+    parser.add_argument("input", help="Complex NIfTI file, directory or glob")
+    parser.add_argument("output", nargs="?", help="Output file (single input) or directory (batch)")
+    parser.add_argument("--phase", nargs="?", const=True, default=None,
+                        help="Also write phase; optional output path for a single file")
+    parser.add_argument("--slab", type=int, default=16, help="z-slices per chunk")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel conversions")
+    args = parser.parse_args()
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    convert_complex_to_float(input_file, output_file)
+    # Legacy form: one input file and one output file
+    if os.path.isfile(args.input) and args.output and not os.path.isdir(args.output):
+        phase = args.phase
+        if phase is True:
+            head, name = os.path.split(args.output)
+            ext = next((e for e in (".nii.gz", ".nii") if name.endswith(e)), "")
+            phase = os.path.join(head, name[:len(name) - len(ext)] + "_phase" + ext)
+        convert_complex_to_float(args.input, args.output, phase, args.slab)
+    else:
+        files = expand_inputs(args.input)
+        if not files:
+            parser.error(f"No complex NIfTI images found for {args.input}")
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        jobs = [(f, *output_names(f, args.output, bool(args.phase)), args.slab) for f in files]
+        print(f"Converting {len(jobs)} complex images with {args.jobs} workers")
+        failed = []
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            for path, err in pool.map(_convert_one, jobs):
+                if err:
+                    print(f"Failed {path}: {err}")
+                    failed.append(path)
+        print(f"Done: {len(jobs) - len(failed)} converted, {len(failed)} failed")
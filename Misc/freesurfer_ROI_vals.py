@@ -1,60 +1,107 @@
 #!/usr/bin/env python
+"""
+Convert every .mgz in a folder to NIfTI and count the voxels (and mm^3)
+of each label value.
+
+Labels are counted with np.bincount on the image's integer data (np.unique
+for sparse labels or NaNs), and the NIfTI keeps the MGZ's data type (a
+uint8 label image stays uint8). Add --gzip to write .nii.gz. Files are
+processed in parallel.
+
+Output (in <mgz_folder>/nii_converted):
+    <name>.nii[.gz]                  one per .mgz
+    mgz_voxel_counts_master.csv      ROI, Value, VoxelCount, Volume_mm3
+
+Usage:
+    python freesurfer_ROI_vals.py <mgz_folder_path> [--gzip] [--jobs 8]
+"""
 
 import os
 import sys
+import argparse
 import nibabel as nib
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-def main(mgz_folder):
-    output_folder = os.path.join(mgz_folder, "nii_converted")
-    os.makedirs(output_folder, exist_ok=True)
 
-    all_rows = []
+def label_census(data):
+    """(values, counts) of every value present in an integer label array.
+
+    Uses np.bincount when the label range is compact, np.unique otherwise
+    (sparse or very wide values, or NaN/inf in float-stored labels, which
+    are then reported as float values).
+    """
+    data = np.asarray(data)
+    if data.dtype.kind == 'f':
+        # Float-stored labels: round as before, but only once
+        data = np.round(data)
+        if not np.isfinite(data).all():
+            return np.unique(data, return_counts=True)
+        data = data.astype(np.int64)
+    flat = data.ravel()
+    if flat.size == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    lo, hi = int(flat.min()), int(flat.max())
+    if hi - lo > 2 * flat.size + (1 << 16) or hi > np.iinfo(np.int64).max:
+        # bincount would allocate hi - lo + 1 bins
+        return np.unique(flat, return_counts=True)
+    # Shift in int64: flat - lo can overflow the native dtype (e.g. int8 -128..127)
+    counts = np.bincount(flat.astype(np.int64, copy=False) - lo)
+    values = np.flatnonzero(counts)
+    return values + lo, counts[values]
 
-    for file in os.listdir(mgz_folder):
-        if file.endswith(".mgz"):
-            mgz_path = os.path.join(mgz_folder, file)
-            nii_filename = file.replace(".mgz", ".nii")
-            nii_path = os.path.join(output_folder, nii_filename)
 
-            # Load .mgz
-            img = nib.load(mgz_path)
-            data = img.get_fdata()
+def convert_one(mgz_path, output_folder, gzip=False):
+    """Convert one .mgz and return its census rows."""
+    file = os.path.basename(mgz_path)
+    name = file.replace(".mgz", "")
+    nii_path = os.path.join(output_folder, name + (".nii.gz" if gzip else ".nii"))
 
-            # Convert to integer for counting discrete voxel intensities
-            data_int = np.round(data).astype(np.int32)
+    img = nib.load(mgz_path)
+    data = np.asanyarray(img.dataobj)
+    voxel_mm3 = float(np.prod(img.header.get_zooms()[:3]))
 
-            # Count voxels
-            unique, counts = np.unique(data_int, return_counts=True)
+    values, counts = label_census(data)
+    rows = [{"ROI": name, "Value": int(v), "VoxelCount": int(c), "Volume_mm3": round(c * voxel_mm3, 4)}
+            for v, c in zip(values, counts)]
 
-            # Append to master list
-            for val, cnt in zip(unique, counts):
-                all_rows.append({
-                    "ROI": file.replace(".mgz", ""),
-                    "Value": val,
-                    "VoxelCount": cnt
-                })
+    # Save NIfTI with the original data type
+    out = nib.Nifti1Image(data, img.affine, img.header)
+    out.set_data_dtype(data.dtype)
+    nib.save(out, nii_path)
+    print(f"Processed {file} -> {os.path.basename(nii_path)}")
+    return rows
 
-            # Save NIfTI
-            nib.save(nib.Nifti1Image(data, img.affine, img.header), nii_path)
-            print(f"Processed {file} -> {nii_filename}")
+
+def main(mgz_folder, gzip=False, jobs=None):
+    output_folder = os.path.join(mgz_folder, "nii_converted")
+    os.makedirs(output_folder, exist_ok=True)
+
+    files = [os.path.join(mgz_folder, f) for f in sorted(os.listdir(mgz_folder)) if f.endswith(".mgz")]
+    all_rows = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(convert_one, f, output_folder, gzip) for f in files]
+        for f in futures:
+            all_rows.extend(f.result())
 
     # Save master CSV
     master_csv_path = os.path.join(output_folder, "mgz_voxel_counts_master.csv")
-    df_master = pd.DataFrame(all_rows)
+    df_master = pd.DataFrame(all_rows, columns=["ROI", "Value", "VoxelCount", "Volume_mm3"])
     df_master.to_csv(master_csv_path, index=False)
     print("Master CSV saved:", master_csv_path)
     print("All files processed.")
 
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python mgz_to_nii_voxelcount_master.py <mgz_folder_path>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Convert .mgz to NIfTI and count voxels per label")
+    parser.add_argument("mgz_folder", help="Folder with .mgz files")
+    parser.add_argument("--gzip", action="store_true", help="Write .nii.gz instead of .nii")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Files processed in parallel")
+    args = parser.parse_args()
 
-    mgz_folder = sys.argv[1]
-    if not os.path.isdir(mgz_folder):
-        print("Error: Folder does not exist:", mgz_folder)
+    if not os.path.isdir(args.mgz_folder):
+        print("Error: Folder does not exist:", args.mgz_folder)
         sys.exit(1)
 
-    main(mgz_folder)
+    main(args.mgz_folder, args.gzip, args.jobs)
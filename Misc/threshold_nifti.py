@@ -1,22 +1,153 @@
-#!/usr/local/bin/bash python
-import nibabel as nib
-import numpy as np
+#!/usr/bin/env python
+"""
+Threshold one or many NIfTI images at one or many thresholds in one pass.
+
+Each image is read once, slab by slab, and every requested mask is
+computed from the same slab and appended to its own uint8 output. With
+--packed, all masks go into one image instead: bit i (value 2**i) is set
+where condition i holds. Images are processed in parallel.
+
+Operators: le (<=, the default), lt (<), ge (>=), gt (>). Give one for
+all thresholds or one per threshold.
+
+Outputs are written to --outdir (default: next to each input) as
+<name>_<op><thr>.nii.gz, or <name>_thr.nii.gz with --packed (the bit
+order is saved in <name>_thr.json).
+
+Usage:
+    python threshold_nifti.py input.nii.gz output_thr.nii.gz 0.2
+    python threshold_nifti.py --in "sub-*/dti_FA.nii.gz" --thr 0.2 0.3 0.4 --op ge --jobs 8
+    python threshold_nifti.py --in wm_prob.nii.gz --thr 0.5 0.9 --op gt --packed --outdir masks
+"""
+
+import os
 import sys
+import glob
+import json
+import itertools
+import argparse
+from contextlib import ExitStack
+import numpy as np
+import nibabel as nib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PET", "pet_suvr"))
+from nifti_stream import SlabWriter  # noqa: E402
+
+OPS = {"le": np.less_equal, "lt": np.less, "ge": np.greater_equal, "gt": np.greater}
+
+
+def iter_blocks(img, slab=16):
+    """float64 z-slabs of every volume, in NIfTI on-disk order.
+
+    float64 as in the original get_fdata() version, so voxels at a
+    threshold are classified the same way. A 2D image is one slab.
+    """
+    prox = img.dataobj
+    if len(img.shape) < 3:
+        yield np.asarray(prox[...], dtype=np.float64).reshape(img.shape[:2] + (1,))
+        return
+    nz = img.shape[2]
+    for vol in itertools.product(*(range(n) for n in img.shape[3:])):
+        for z0 in range(0, nz, slab):
+            yield np.asarray(prox[(slice(None), slice(None), slice(z0, min(z0 + slab, nz))) + vol],
+                             dtype=np.float64)
+
+
+def mask_name(op, thr):
+    return f"{op}{thr:g}"
+
+
+def threshold_image(input_file, conditions, outputs=None, packed=None, slab=16):
+    """Write one uint8 mask per (op, thr) in ``conditions``, or one packed image.
+
+    ``outputs`` lists the mask paths (one per condition); ``packed`` is
+    the path of the bit-packed image. Returns the written paths.
+    """
+    img = nib.load(input_file)
+    if packed:
+        n = len(conditions)
+        dtype = np.uint8 if n <= 8 else np.uint16 if n <= 16 else np.uint32 if n <= 32 else None
+        if dtype is None:
+            raise ValueError(f"--packed supports at most 32 thresholds, got {n}")
+        bits = [dtype(1 << i) for i in range(n)]
+
+    with ExitStack() as stack:
+        if packed:
+            writers = [stack.enter_context(SlabWriter(packed, img.affine, img.header, img.shape, dtype))]
+        else:
+            writers = [stack.enter_context(SlabWriter(p, img.affine, img.header, img.shape, np.uint8)) for p in outputs]
+        for block in iter_blocks(img, slab):
+            if packed:
+                out = np.zeros(block.shape, dtype=dtype)
+                for (op, thr), bit in zip(conditions, bits):
+                    out[OPS[op](block, thr)] |= bit
+                writers[0].write(out)
+            else:
+                for (op, thr), w in zip(conditions, writers):
+                    w.write(OPS[op](block, thr).view(np.uint8))
+
+    if packed:
+        head, name = os.path.split(packed)
+        stem = name.replace(".nii.gz", "").replace(".nii", "")
+        with open(os.path.join(head, stem + ".json"), "w") as f:
+            json.dump({"source": os.path.abspath(input_file),
+                       "bits": {str(1 << i): mask_name(op, thr) for i, (op, thr) in enumerate(conditions)}},
+                      f, indent=2)
+        return [packed]
+    return list(outputs)
+
+
+def _threshold_job(job):
+    src, conditions, outputs, packed, slab = job
+    try:
+        written = threshold_image(src, conditions, outputs, packed, slab)
+        print(f"Thresholded {src} -> {len(written)} file(s)")
+        return src, None
+    except Exception as e:
+        return src, str(e)
+
 
-# Usage: python threshold_nifti.py input.nii.gz output_thr.nii.gz 0.2
+if __name__ == "__main__":
+    # Legacy form: input output threshold (mask = data <= threshold)
+    if len(sys.argv) == 4 and not any(a.startswith("--") for a in sys.argv[1:]):
+        threshold_image(sys.argv[1], [("le", float(sys.argv[3]))], [sys.argv[2]])
+        print(f"Thresholded image saved to {sys.argv[2]}")
+        sys.exit(0)
 
-input_file = sys.argv[1]
-output_file = sys.argv[2]
-threshold = float(sys.argv[3])
+    parser = argparse.ArgumentParser(description="Threshold NIfTI images at several thresholds in one pass")
+    parser.add_argument("--in", dest="inputs", nargs="+", required=True, help="Input images (globs allowed)")
+    parser.add_argument("--thr", type=float, nargs="+", required=True, help="Thresholds")
+    parser.add_argument("--op", nargs="+", choices=sorted(OPS), default=["le"],
+                        help="Comparison(s): one for all thresholds or one per threshold")
+    parser.add_argument("--packed", action="store_true", help="Write one bit-packed label image per input")
+    parser.add_argument("--outdir", help="Output directory (default: next to each input)")
+    parser.add_argument("--slab", type=int, default=16, help="z-slices per chunk")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Images processed in parallel")
+    args = parser.parse_args()
 
-# Load image
-img = nib.load(input_file)
-data = img.get_fdata()  # ensures float64, avoids truncation issues
+    if len(args.op) not in (1, len(args.thr)):
+        parser.error("--op needs one operator or one per threshold")
+    ops = args.op * len(args.thr) if len(args.op) == 1 else args.op
+    conditions = list(zip(ops, args.thr))
+    files = [p for pat in args.inputs for p in (sorted(glob.glob(pat)) or [pat])]
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
 
-# Threshold
-mask = (data <= threshold).astype(np.float32)  # or np.uint8 if you prefer
+    jobs = []
+    for f in files:
+        stem = os.path.basename(f).replace(".nii.gz", "").replace(".nii", "")
+        out = lambda suffix: os.path.join(args.outdir or os.path.dirname(os.path.abspath(f)),
+                                          f"{stem}_{suffix}.nii.gz")
+        if args.packed:
+            jobs.append((f, conditions, None, out("thr"), args.slab))
+        else:
+            jobs.append((f, conditions, [out(mask_name(o, t)) for o, t in conditions], None, args.slab))
 
-# Save as new NIfTI
-out_img = nib.Nifti1Image(mask, img.affine, img.header)
-nib.save(out_img, output_file)
-print(f"Thresholded image saved to {output_file}")
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for src, err in pool.map(_threshold_job, jobs):
+            if err:
+                print(f"Failed {src}: {err}")
+                failed.append(src)
+    print(f"Done: {len(jobs) - len(failed)} images, {len(conditions)} thresholds, {len(failed)} failed")
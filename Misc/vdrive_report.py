@@ -2,13 +2,16 @@
 import os
 import json
 import time
+import argparse
 import shutil
+import sqlite3
 import matplotlib.pyplot as plt
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
 
 #############################################
@@ -20,95 +23,193 @@ PLAYAREA = f"{ROOT}/helpern_playarea"
 USERS = f"{ROOT}/helpern_users"
 
 OUTPUT_PDF = "/Volumes/vdrive/server_space_report.pdf"
-CACHE_FILE = os.path.expanduser("~/.server_space_cache.json")
+INDEX_FILE = os.path.expanduser("~/.server_space_index.sqlite")
+
+# Concurrent directory scans; high because each SMB request mostly waits
+SCAN_THREADS = 32
+
+# Index rows older than this are listed again even if the directory mtime
+# is unchanged, to pick up files rewritten in place (see DirIndex)
+MAX_ROW_AGE_DAYS = 7
 
 #############################################
-# CACHE FUNCTIONS
+# DIRECTORY INDEX
 #############################################
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, "r") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_cache(cache):
-    with open(CACHE_FILE, "w") as f:
-        json.dump(cache, f, indent=2)
-
-def folder_modified_time(path):
-    """Return the latest modification time inside a directory."""
-    latest = 0
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            fp = os.path.join(root, f)
-            try:
-                m = os.path.getmtime(fp)
-                if m > latest:
-                    latest = m
-            except:
-                pass
-    return latest
+class DirIndex:
+    """Persistent per-directory index (sqlite).
+
+    One row per directory: its own mtime, the size, count and latest
+    mtime of the files directly in it, its subdirectories, and its
+    hard-linked files. A directory whose mtime is unchanged since the
+    last report is not listed again; its row is reused and only its
+    subdirectories are checked. Note that a directory's mtime changes
+    when entries are added, removed or renamed, not when an existing
+    file is rewritten in place. To catch those, a row is only reused
+    for ``max_age_days`` after it was listed; ``full_rescan`` lists
+    every directory again.
+
+    Changes are kept in memory and written in one transaction by save().
+    """
+
+    def __init__(self, path, max_age_days=MAX_ROW_AGE_DAYS, full_rescan=False):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, nfiles INTEGER,
+            latest REAL, subdirs TEXT, links TEXT, listed_at REAL)""")
+        if "listed_at" not in [c[1] for c in self.db.execute("PRAGMA table_info(dirs)")]:
+            # Index from an older version: its rows count as expired
+            self.db.execute("ALTER TABLE dirs ADD COLUMN listed_at REAL DEFAULT 0")
+        self.rows = {r[0]: r[1:] for r in self.db.execute("SELECT * FROM dirs")}
+        self.max_age = max_age_days * 86400
+        self.full_rescan = full_rescan
+        self.updated = {}
+        self.visited = set()
+        self.roots = set()
+
+    def get(self, path):
+        return self.rows.get(path)
+
+    def reusable(self, path):
+        """The row for ``path`` if it may be reused, else None."""
+        row = self.rows.get(path)
+        if row is None or self.full_rescan or time.time() - (row[6] or 0) > self.max_age:
+            return None
+        return row
+
+    def put(self, path, row):
+        self.updated[path] = row
+        self.rows[path] = row
+
+    def save(self):
+        """Write new/changed rows and drop directories that no longer exist."""
+        stale = [p for p in self.rows if p not in self.visited
+                 and any(p == r or p.startswith(r + os.sep) for r in self.roots)]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(p,) + row for p, row in self.updated.items()])
+            self.db.executemany("DELETE FROM dirs WHERE path = ?", [(p,) for p in stale])
+        for p in stale:
+            del self.rows[p]
+        self.updated.clear()
+
+    def close(self):
+        self.db.close()
 
 #############################################
 # FILE SIZE FUNCTIONS
 #############################################
 
-def folder_size(path, cache):
-    """Return folder size using cache when possible, with progress."""
-    path = os.path.abspath(path)
+def scan_dir(path):
+    """Size, count and latest mtime of the files directly in ``path``.
 
-    # Check if cached
-    if path in cache:
-        cached = cache[path]
-        current_mtime = folder_modified_time(path)
-
-        if current_mtime <= cached["folder_mtime"]:
-            # Folder unchanged — use cached value
-            return cached["size"]
-
-    # Folder changed or uncached — scan
-    total_size = 0
-    file_list = []
-
-    # Build list of files first (fast)
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            file_list.append(os.path.join(root, f))
-
-    # Progress bar for size calculation
-    for fp in tqdm(file_list, desc=f"Scanning {path}", unit="files"):
-        try:
-            total_size += os.path.getsize(fp)
-        except:
-            pass
-
-    # Save updated cache entry
-    cache[path] = {
-        "size": total_size,
-        "folder_mtime": folder_modified_time(path),
-        "cached_at": time.time()
-    }
-
-    save_cache(cache)
-    return total_size
+    One os.scandir pass; the stat results come with the DirEntry. Files
+    with several hard links are returned separately so the caller can
+    count each inode once.
+    """
+    size, nfiles, latest, subdirs, links = 0, 0, 0, [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                nfiles += 1
+                if st.st_nlink > 1:
+                    links.append(((st.st_dev, st.st_ino), st.st_size))
+                else:
+                    size += st.st_size
+                latest = max(latest, st.st_mtime)
+    except OSError:
+        pass
+    return size, nfiles, latest, subdirs, links
+
+def index_dir(path, row):
+    """scan_dir, or the cached ``row`` if the directory's mtime is unchanged.
+
+    ``row`` is None when the index has no usable entry (see DirIndex.reusable).
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return scan_dir(path), None
+    if row is not None and row[0] == mtime_ns:
+        _, size, nfiles, latest, subdirs, links, _ = row
+        return (size, nfiles, latest, json.loads(subdirs), [(tuple(k), s) for k, s in json.loads(links)]), None
+    listed_at = time.time()
+    result = scan_dir(path)
+    size, nfiles, latest, subdirs, links = result
+    return result, (mtime_ns, size, nfiles, latest, json.dumps(subdirs), json.dumps(links), listed_at)
+
+def scan_trees(paths, index=None, threads=SCAN_THREADS):
+    """Return {path: (size, file count, latest file mtime)} for several trees.
+
+    Directories from all trees are scanned concurrently by a thread pool,
+    which hides the per-request latency of the SMB share. Hard-linked
+    inodes are counted once overall, in the first tree that has them. With an ``index``, unchanged
+    directories are taken from it and only need one stat.
+    """
+    totals = {p: [0, 0, 0] for p in paths}
+    owner = {}
+    relisted = 0
+    if index is not None:
+        index.roots.update(paths)
+
+    def submit(pool, d):
+        if index is None:
+            return pool.submit(lambda: (scan_dir(d), None))
+        return pool.submit(index_dir, d, index.reusable(d))
+
+    with ThreadPoolExecutor(max_workers=threads) as pool, \
+            tqdm(desc=f"Scanning {os.path.commonpath(paths) if paths else ''}", unit="dirs") as bar:
+        pending = {submit(pool, p): (p, p) for p in paths}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                root, path = pending.pop(fut)
+                (size, nfiles, latest, subdirs, links), row = fut.result()
+                if index is not None:
+                    index.visited.add(path)
+                    if row is not None:
+                        index.put(path, row)
+                        relisted += 1
+                for key, s in links:
+                    # Each shared inode goes to the first tree (in order) that has it
+                    if key not in owner or root < owner[key][0]:
+                        owner[key] = (root, s)
+                t = totals[root]
+                t[0] += size
+                t[1] += nfiles
+                t[2] = max(t[2], latest)
+                for d in subdirs:
+                    pending[submit(pool, d)] = (root, d)
+                bar.update(1)
+    for root, s in owner.values():
+        totals[root][0] += s
+    if index is not None:
+        print(f"Listed {relisted} new, changed or expired directories")
+    return {p: tuple(t) for p, t in totals.items()}
+
+def folder_size(path, index=None):
+    """Return the size of one folder."""
+    path = os.path.abspath(path)
+    return scan_trees([path], index)[path][0]
 
 def bytes_to_gb(b):
     return b / (1024**3)
 
-def get_subfolder_sizes(base_path, cache):
+def get_subfolder_sizes(base_path, index=None):
     subfolders = sorted([
         f for f in os.listdir(base_path)
         if os.path.isdir(os.path.join(base_path, f))
     ])
-    sizes = {}
-    for sf in subfolders:
-        p = os.path.join(base_path, sf)
-        sizes[sf] = folder_size(p, cache)
-    return sizes
+    paths = [os.path.abspath(os.path.join(base_path, sf)) for sf in subfolders]
+    scanned = scan_trees(paths, index)
+    return {sf: scanned[p][0] for sf, p in zip(subfolders, paths)}
 
 #############################################
 # PLOTTING
@@ -135,14 +236,23 @@ def make_bar_plot(data_dict, title):
 #############################################
 
 if __name__ == "__main__":
-    cache = load_cache()
+    parser = argparse.ArgumentParser(description="PDF report of vdrive space usage")
+    parser.add_argument("--full-rescan", action="store_true",
+                        help="List every directory again instead of reusing the index")
+    parser.add_argument("--max-age-days", type=float, default=MAX_ROW_AGE_DAYS,
+                        help="Re-list directories whose index row is older than this")
+    args = parser.parse_args()
+
+    index = DirIndex(INDEX_FILE, args.max_age_days, args.full_rescan)
 
     # Overall disk usage
     total, used, free = shutil.disk_usage(ROOT)
 
-    # Subfolder sizes with caching + progress bars
-    playarea_sizes = get_subfolder_sizes(PLAYAREA, cache)
-    users_sizes = get_subfolder_sizes(USERS, cache)
+    # Subfolder sizes from the directory index + progress bars
+    playarea_sizes = get_subfolder_sizes(PLAYAREA, index)
+    users_sizes = get_subfolder_sizes(USERS, index)
+    index.save()
+    index.close()
 
     # Plots
     playarea_plot = make_bar_plot(playarea_sizes,
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark in-process mask means (fsl_stats.masked_means) against the old
+per-call ``fslstats -k mask -M`` path on a synthetic subject.
+
+A subject is two gzipped PETs in 1 mm MNI size and a target and a
+reference mask, i.e. the four means the calibration scripts need per
+subject. Without fslstats on PATH only the in-process time is reported.
+
+Usage:
+    python benchmark_fslstats.py [--shape 182 218 182] [--repeats 3]
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import nibabel as nib
+
+from fsl_stats import masked_means
+
+
+def make_subject(outdir, shape, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = np.ogrid[tuple(slice(-1, 1, n * 1j) for n in shape)]
+    r = np.sqrt(sum(g ** 2 for g in grid))
+    brain = r < 0.8
+    affine = np.diag([1.0, 1.0, 1.0, 1.0])
+
+    pets = []
+    for name in ("PET_A", "PET_B"):
+        pet = np.where(brain, rng.gamma(4.0, 0.5, shape), 0).astype(np.float32)
+        path = os.path.join(outdir, f"{name}.nii.gz")
+        nib.save(nib.Nifti1Image(pet, affine), path)
+        pets.append(path)
+
+    masks = []
+    for name, sel in (("ctx", (r > 0.5) & (r < 0.75)), ("ref", r < 0.2)):
+        path = os.path.join(outdir, f"{name}_mask.nii.gz")
+        nib.save(nib.Nifti1Image(sel.astype(np.uint8), affine), path)
+        masks.append(path)
+    return pets, masks
+
+
+def fslstats_means(pets, masks):
+    out = np.empty((len(pets), len(masks)))
+    for i, pet in enumerate(pets):
+        for j, mask in enumerate(masks):
+            res = subprocess.check_output(['fslstats', pet, '-k', mask, '-M'])
+            out[i, j] = float(res.decode().strip())
+    return out
+
+
+def best_of(func, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        res = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), res
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        pets, masks = make_subject(tmp, tuple(args.shape))
+        print(f"Synthetic subject: 2 PETs x 2 masks, shape {tuple(args.shape)}")
+
+        t_py, py = best_of(lambda: masked_means(pets, masks), args.repeats)
+        print(f"  in-process : {t_py:.3f}s")
+
+        if shutil.which('fslstats') is None:
+            print("  fslstats   : not on PATH, skipped")
+            return
+        t_fsl, fsl = best_of(lambda: fslstats_means(pets, masks), args.repeats)
+        print(f"  fslstats   : {t_fsl:.3f}s")
+        print(f"  speedup    : {t_fsl / t_py:.1f}x, max rel. difference "
+              f"{np.max(np.abs(py - fsl) / np.abs(fsl)):.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark mask means vs fslstats")
+    parser.add_argument("--shape", type=int, nargs=3, default=[182, 218, 182], help="Image shape")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats (best is reported)")
+    main(parser.parse_args())
@@ -1,49 +1,193 @@
 #!/usr/bin/env python3
 """
-Apply a Centiloid conversion formula (saved from calibration)
-to a CSV of Florbetaben SUVRs.
+Apply Centiloid conversion formulas (saved from calibration) to a CSV or
+Parquet table of SUVRs.
+
+With --registry, each row's tracer (from --tracer_col, or --tracer for
+the whole table) picks its calibration from the formula registry, so a
+mixed-tracer cohort is converted in one vectorized pass. With --formula,
+one legacy centiloid_formula.txt is applied to every row.
+
+Inputs larger than --chunksize rows are streamed chunk by chunk, so
+memory stays bounded. A Parquet input may be one file or a dataset
+directory of part files (as 3_PET_mSUVr_calc.py writes); a stored pandas
+index such as studyid is read back as an ordinary column and kept in
+the output. A Parquet output gets one schema declared up
+front (see output_schema), so chunks with differently inferred column
+types are still written to the same file.
 
 Example:
-    python apply_centiloid_formula.py \
+    python calibrated_centiloid_formula.py \
+        --input cohort.parquet \
+        --registry /path/to/centiloid_formulas.json --voi_set AVID \
+        --out cohort_centiloid.parquet
+
+    python calibrated_centiloid_formula.py \
         --input my_data.csv \
         --formula /path/to/centiloid_formula.txt \
         --out my_data_centiloid.csv
 """
 
+import os
 import argparse
+import numpy as np
 import pandas as pd
-import re
-
-def parse_formula(path):
-    """Read A and B from centiloid_formula.txt."""
-    A, B = None, None
-    with open(path, "r") as f:
-        for line in f:
-            if line.startswith("A"):
-                A = float(re.findall(r"[-+]?\d*\.\d+|\d+", line)[0])
-            elif line.startswith("B"):
-                B = float(re.findall(r"[-+]?\d*\.\d+|\d+", line)[0])
-    if A is None or B is None:
-        raise ValueError("Could not read A and B from formula file.")
-    return A, B
+
+from formula_registry import load_registry, select_formulas, normalize_tracer, parse_formula_txt
+
+
+def apply_formulas(df, suvr_col, coefs, tracer_col=None, tracer=None):
+    """Add a 'centiloid' column. ``coefs`` is {tracer: (A, B)} or (A, B).
+
+    Rows whose tracer has no formula get NaN. Returns the number of them.
+    """
+    if suvr_col not in df.columns:
+        raise ValueError(f"Input must have a column named '{suvr_col}'")
+    suvr = pd.to_numeric(df[suvr_col], errors="coerce").to_numpy(dtype=float)
+
+    if isinstance(coefs, tuple):
+        df["centiloid"] = coefs[0] * suvr + coefs[1]
+        return 0
+
+    if tracer_col:
+        # Normalize each distinct spelling once, then map rows by category code
+        codes, uniques = pd.factorize(df[tracer_col])
+        names = [normalize_tracer(u) for u in uniques]
+    else:
+        codes, names = np.zeros(len(df), dtype=int), [normalize_tracer(tracer)]
+    A = np.array([coefs.get(n, (np.nan, np.nan))[0] for n in names] + [np.nan])
+    B = np.array([coefs.get(n, (np.nan, np.nan))[1] for n in names] + [np.nan])
+    # factorize gives -1 for missing tracers, which indexes the trailing NaN
+    df["centiloid"] = A[codes] * suvr + B[codes]
+    return int(np.isnan(A[codes]).sum())
+
+
+def is_parquet(path):
+    return path.endswith(".parquet") or os.path.isdir(path)
+
+
+def open_dataset(path):
+    """Parquet file or dataset directory, with a stored pandas index (e.g.
+    studyid) moved to the front as ordinary columns."""
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format="parquet")
+    meta = dataset.schema.pandas_metadata or {}
+    index = [c for c in meta.get("index_columns", []) if isinstance(c, str)]
+    return dataset, index + [c for c in dataset.schema.names if c not in index]
+
+
+def iter_chunks(path, chunksize):
+    if is_parquet(path):
+        dataset, columns = open_dataset(path)
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            # ignore_metadata: keep the index columns as columns
+            yield batch.to_pandas(ignore_metadata=True)
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def _merged_type(kinds, has_null):
+    """Arrow type of a CSV column from the dtype kinds of its non-blank chunks."""
+    import pyarrow as pa
+    if kinds <= {"i", "u"} and kinds and not has_null:
+        return pa.int64()
+    if kinds <= {"i", "u", "f"}:
+        return pa.float64()  # also all-blank columns, which pandas reads as NaN
+    if kinds == {"b"} and not has_null:
+        return pa.bool_()
+    return pa.string()
+
+
+def output_schema(path, chunksize):
+    """Arrow schema that every output chunk is written with.
+
+    Parquet inputs keep their own schema. For CSV, pandas infers types per
+    chunk (an int column with blanks in a later chunk becomes float, an
+    all-blank chunk is float where others are text), so the types are
+    merged over one extra streaming pass. 'centiloid' is always float64.
+    """
+    import pyarrow as pa
+    if is_parquet(path):
+        dataset, columns = open_dataset(path)
+        schema = pa.schema([dataset.schema.field(c) for c in columns])
+    else:
+        kinds, nulls = {}, {}
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            for col in chunk.columns:
+                present = chunk[col].notna()
+                kinds.setdefault(col, set())
+                nulls[col] = nulls.get(col, False) or not present.all()
+                if present.any():
+                    kinds[col].add(chunk[col].dtype.kind)
+        schema = pa.schema([(col, _merged_type(k, nulls[col])) for col, k in kinds.items()])
+    if "centiloid" in schema.names:
+        return schema.set(schema.get_field_index("centiloid"), pa.field("centiloid", pa.float64()))
+    return schema.append(pa.field("centiloid", pa.float64()))
+
+
+def conform(chunk, schema):
+    """Arrow table of ``chunk`` with ``schema``; numbers in text columns become text."""
+    import pyarrow as pa
+    for field in schema:
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            col = chunk[field.name]
+            if col.dtype.kind != "O":
+                chunk[field.name] = col.astype(object).map(str, na_action="ignore")
+    return pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False)
+
 
 def main(args):
-    df = pd.read_csv(args.input)
-    A, B = parse_formula(args.formula)
+    if args.registry:
+        formulas = select_formulas(load_registry(args.registry), args.voi_set, args.pipeline)
+        if not formulas:
+            raise ValueError(f"No formulas in {args.registry} for voi_set={args.voi_set}, pipeline={args.pipeline}")
+        coefs = {t: (e["A"], e["B"]) for t, e in formulas.items()}
+        for t, e in sorted(formulas.items()):
+            print(f"Applying {t} formula ({e['voi_set']}, {e['pipeline']}): "
+                  f"CL = {e['A']:.4f} * SUVR + {e['B']:.4f}")
+        if not args.tracer_col and not args.tracer:
+            raise ValueError("--registry needs --tracer_col or --tracer")
+    else:
+        A, B = parse_formula_txt(args.formula)
+        coefs = (A, B)
+        print(f"Applying Centiloid formula: CL = {A:.4f} * SUVR + {B:.4f}")
 
-    print(f"Applying Centiloid formula: CL = {A:.4f} * SUVR + {B:.4f}")
-    if "msuvr" not in df.columns:
-        raise ValueError("Input CSV must have a column named 'msuvr'")
+    writer = None
+    if args.out.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        schema = output_schema(args.input, args.chunksize)
+    n_rows = n_missing = 0
+    try:
+        for i, chunk in enumerate(iter_chunks(args.input, args.chunksize)):
+            n_missing += apply_formulas(chunk, args.suvr_col, coefs, args.tracer_col, args.tracer)
+            n_rows += len(chunk)
+            if args.out.endswith(".parquet"):
+                if writer is None:
+                    writer = pq.ParquetWriter(args.out, schema)
+                writer.write_table(conform(chunk, schema))
+            else:
+                chunk.to_csv(args.out, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+    finally:
+        if writer is not None:
+            writer.close()
 
-    df["centiloid"] = A * df["msuvr"] + B
-    df.to_csv(args.out, index=False)
+    if n_missing:
+        print(f"⚠️  {n_missing} of {n_rows} rows have no formula for their tracer (centiloid = NaN)")
+    print(f"✅ Saved Centiloid results for {n_rows} rows to: {args.out}")
 
-    print(f"✅ Saved Centiloid results to: {args.out}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="CSV file with 'subject' and 'msuvr'")
-    parser.add_argument("--formula", required=True, help="Path to centiloid_formula.txt")
-    parser.add_argument("--out", required=True, help="Output CSV path")
+    parser.add_argument("--input", required=True, help="CSV or Parquet file with an SUVR column")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--formula", help="Path to a legacy centiloid_formula.txt")
+    src.add_argument("--registry", help="Formula registry JSON (see formula_registry.py)")
+    parser.add_argument("--out", required=True, help="Output path (.csv or .parquet)")
+    parser.add_argument("--suvr_col", default="msuvr", help="SUVR column (default: msuvr)")
+    parser.add_argument("--tracer_col", help="Column with each row's tracer (registry mode)")
+    parser.add_argument("--tracer", help="Tracer for all rows if there is no tracer column")
+    parser.add_argument("--voi_set", help="Use formulas for this VOI set")
+    parser.add_argument("--pipeline", help="Use formulas for this pipeline version")
+    parser.add_argument("--chunksize", type=int, default=500000, help="Rows per streamed chunk")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Check fsl_warp.py against FSL applywarp.
+
+For every combination of reference and source orientation (radiological,
+i.e. negative-determinant affine, and neurological) a synthetic source
+is registered to a deformed reference with FLIRT + FNIRT. The resulting
+warp is then applied both by applywarp and in-process, as
+  - the cubic B-spline coefficient file (--cout),
+  - the relative displacement field (--fout),
+  - an absolute field from convertwarp --absout (applywarp --abs),
+with trilinear interpolation for the image and nearest neighbour for a
+label mask. The trilinear error is reported relative to the image range;
+for nn, the fraction of voxels with a different label.
+Exits non-zero if any case is outside the tolerance.
+
+Usage:
+    python check_fsl_warp.py [--keep /tmp/check_fsl_warp] [--tol 1e-3] [--nn-tol 1e-3]
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import nibabel as nib
+
+from fsl_warp import FnirtWarp
+
+SHAPE = (40, 48, 36)
+ORIENTATIONS = {
+    "radiological": np.array([[-2.0, 0, 0, 39.0], [0, 2.0, 0, -47.0], [0, 0, 2.0, -35.0], [0, 0, 0, 1]]),
+    "neurological": np.array([[2.0, 0, 0, -39.0], [0, 2.0, 0, -47.0], [0, 0, 2.0, -35.0], [0, 0, 0, 1]]),
+}
+
+
+def phantom(affine, shift=(0.0, 0.0, 0.0), bend=0.0):
+    """Smooth asymmetric head-like image and a label mask, in world mm."""
+    ijk = np.indices(SHAPE).reshape(3, -1)
+    x, y, z = (affine[:3, :3] @ ijk + affine[:3, 3:]).reshape((3,) + SHAPE)
+    x = x - shift[0] - bend * np.sin(y / 15.0)
+    y, z = y - shift[1], z - shift[2]
+    r = np.sqrt((x / 30) ** 2 + (y / 38) ** 2 + (z / 28) ** 2)
+    img = 100 * np.exp(-((r / 0.8) ** 8)) * (1 + 0.4 * np.tanh(x / 10)) \
+        + 60 * np.exp(-(((x - 10) ** 2 + (y + 8) ** 2 + z ** 2) / 60.0))
+    labels = ((r < 0.7).astype(np.uint8) + ((x > 5) & (r < 0.7))).astype(np.uint8)
+    return img.astype(np.float32), labels
+
+
+def run(cmd, log):
+    with open(log, "a") as f:
+        subprocess.run(cmd, check=True, stdout=f, stderr=subprocess.STDOUT)
+
+
+def compare(ours, fsl, nn, inside):
+    a = np.asarray(nib.load(ours).dataobj, dtype=np.float64)
+    b = np.asarray(nib.load(fsl).dataobj, dtype=np.float64)
+    if nn:
+        return float(np.mean(a[inside] != b[inside]))
+    return float(np.max(np.abs(a[inside] - b[inside])) / max(np.ptp(b[inside]), 1e-12))
+
+
+def check_case(work, ref_orient, src_orient, tol, nn_tol):
+    d = os.path.join(work, f"ref-{ref_orient}_src-{src_orient}")
+    os.makedirs(d, exist_ok=True)
+    log = os.path.join(d, "fsl.log")
+    p = lambda name: os.path.join(d, name)
+
+    ref_img, _ = phantom(ORIENTATIONS[ref_orient], shift=(3, -2, 1), bend=4.0)
+    src_img, src_lab = phantom(ORIENTATIONS[src_orient])
+    nib.save(nib.Nifti1Image(ref_img, ORIENTATIONS[ref_orient]), p("ref.nii.gz"))
+    nib.save(nib.Nifti1Image(src_img, ORIENTATIONS[src_orient]), p("src.nii.gz"))
+    nib.save(nib.Nifti1Image(src_lab, ORIENTATIONS[src_orient]), p("labels.nii.gz"))
+
+    run(['flirt', '-in', p("src.nii.gz"), '-ref', p("ref.nii.gz"), '-omat', p("aff.mat"), '-dof', '12'], log)
+    run(['fnirt', '--in=' + p("src.nii.gz"), '--ref=' + p("ref.nii.gz"), '--aff=' + p("aff.mat"),
+         '--cout=' + p("coef.nii.gz"), '--fout=' + p("field.nii.gz"),
+         '--subsamp=2,1', '--miter=5,5', '--infwhm=4,2', '--reffwhm=2,0', '--lambda=300,100',
+         '--estint=0,0', '--warpres=10,10,10'], log)
+    run(['convertwarp', '--ref=' + p("ref.nii.gz"), '--warp1=' + p("coef.nii.gz"),
+         '--absout', '--out=' + p("abs.nii.gz")], log)
+
+    # Compare away from the FOV edge, where padding conventions may differ
+    inside = np.zeros(SHAPE, bool)
+    inside[2:-2, 2:-2, 2:-2] = True
+
+    results = []
+    for warp, absolute in (("coef", False), ("field", False), ("abs", True)):
+        for src, interp in (("src", "trilinear"), ("labels", "nn")):
+            fsl_out, our_out = p(f"{src}_{warp}_fsl.nii.gz"), p(f"{src}_{warp}_ours.nii.gz")
+            cmd = ['applywarp', '--ref=' + p("ref.nii.gz"), '--in=' + p(f"{src}.nii.gz"),
+                   '--warp=' + p(f"{warp}.nii.gz"), '--out=' + fsl_out, '--interp=' + interp]
+            run(cmd + (['--abs'] if absolute else []), log)
+            FnirtWarp(p(f"{warp}.nii.gz"), p("ref.nii.gz"), absolute).apply(
+                [p(f"{src}.nii.gz")], [our_out], order={"nn": 0, "trilinear": 1}[interp])
+            err = compare(our_out, fsl_out, interp == "nn", inside)
+            ok = err <= (nn_tol if interp == "nn" else tol)
+            results.append(ok)
+            metric = "mismatch fraction" if interp == "nn" else "max rel. error"
+            print(f"  {'✅' if ok else '❌'} ref {ref_orient:12s} src {src_orient:12s} "
+                  f"{warp:5s} {interp:9s} {metric} {err:.2e}")
+    return all(results)
+
+
+def main(args):
+    for tool in ("flirt", "fnirt", "applywarp", "convertwarp"):
+        if shutil.which(tool) is None:
+            raise SystemExit(f"{tool} is not on PATH; this check needs FSL")
+    work = args.keep or tempfile.mkdtemp(prefix="check_fsl_warp_")
+    os.makedirs(work, exist_ok=True)
+    ok = True
+    for ref_orient in ORIENTATIONS:
+        for src_orient in ORIENTATIONS:
+            ok &= check_case(work, ref_orient, src_orient, args.tol, args.nn_tol)
+    if not args.keep:
+        shutil.rmtree(work)
+    print("✅ fsl_warp matches applywarp" if ok else "❌ fsl_warp differs from applywarp")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fsl_warp.py with FSL applywarp")
+    parser.add_argument("--keep", help="Work in this folder and keep it (default: temporary, removed)")
+    parser.add_argument("--tol", type=float, default=1e-3, help="Trilinear max error / image range")
+    parser.add_argument("--nn-tol", type=float, default=1e-3, help="Nearest-neighbour mismatch fraction")
+    main(parser.parse_args())
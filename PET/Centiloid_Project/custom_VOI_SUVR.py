@@ -5,54 +5,144 @@ Pipeline to register VOIs to subject T1, binarize, resample to PET, and compute
 - MR selection: MR*.nii or MR*.nii.gz
 - Resample: nearest-neighbor to PET voxel grid
 
+Only the T1_std -> subject registration runs FLIRT. The VOIs are resampled
+in-process: the FLIRT matrix and the sforms are composed into one
+PET-voxel -> VOI-voxel mapping, applied with nearest neighbour and
+thresholded in memory. Each PET is loaded once. Intermediate VOI images
+are only written with --keep-intermediates.
+
+Subjects run in a process pool (--jobs). Every step is skipped when its
+output is already valid, and SUVR_results.csv is appended as each subject
+finishes. A rerun after a crash resumes with the subjects that have no
+row yet; a subject with a row is done, even if some SUVRs are NaN.
+
 python3 process_calibration_pipeline.py \
   --ref /Users/kayti/Desktop/Projects/IAM/Centiloids/Calibration/Florbetapir/nifti \
   --voi /Users/kayti/Desktop/Projects/IAM/Centiloids/VOIs \
   --out /Users/kayti/Desktop/Projects/IAM/Centiloids/Calibration/Florbetapir/calibration \
-  --pet PIB FBP
+  --pet PIB FBP --jobs 4
 
 """
 
 import os
+import sys
 import subprocess
 import nibabel as nib
 import numpy as np
 import csv
 import argparse
-
-def flirt_register(in_file, ref_file, out_file, omat_file=None, applyxfm=False):
-    cmd = ["flirt", "-in", in_file, "-ref", ref_file, "-out", out_file]
-    if applyxfm and omat_file:
-        cmd += ["-applyxfm", "-init", omat_file]
-    else:
-        if omat_file:
-            cmd += ["-omat", omat_file]
-    subprocess.run(cmd, check=True)
-
-def binarize_nifti(in_file, out_file):
-    subprocess.run(["fslmaths", in_file, "-bin", out_file], check=True)
-
-def resample_to_pet(mask_file, pet_file, out_file):
-    # nearest-neighbor resampling to PET grid
-    cmd = [
-        "flirt",
-        "-in", mask_file,
-        "-ref", pet_file,
-        "-out", out_file,
-        "-applyxfm",
-        "-usesqform",
-        "-interp", "nearestneighbour"
-    ]
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Shared ROI statistics engine lives with the SUVR scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pet_suvr"))
+from roi_stats import mask_stats  # noqa: E402
+from fsl_affine import flirt_voxel_matrix, sform_voxel_matrix, resample, save_like  # noqa: E402
+
+VOI_FILES = ["VOI_std.nii.gz", "VOI_ref_std.nii.gz"]
+
+def valid_matrix(path):
+    """True if ``path`` holds a finite 4x4 FLIRT matrix."""
+    try:
+        M = np.loadtxt(path)
+    except (OSError, ValueError):
+        return False
+    return M.shape == (4, 4) and np.all(np.isfinite(M))
+
+def flirt_register(in_file, ref_file, omat_file, out_file=None):
+    """Estimate the FLIRT affine in_file -> ref_file (image output optional)."""
+    cmd = ["flirt", "-in", in_file, "-ref", ref_file, "-omat", omat_file]
+    if out_file:
+        cmd += ["-out", out_file]
     subprocess.run(cmd, check=True)
 
-def compute_mean_suvr(pet_file, voi_file):
-    pet = nib.load(pet_file).get_fdata()
-    voi = nib.load(voi_file).get_fdata()
-    mask = voi > 0
-    if np.any(mask):
-        return np.mean(pet[mask])
+def voi_to_pet(voi_img, voi_data, flirt_omat, mri_img, pet_img):
+    """Binary VOI on the PET grid: VOI -(FLIRT)-> MR -(sform)-> PET, nearest neighbour."""
+    vox_map = flirt_voxel_matrix(flirt_omat, voi_img, mri_img) @ sform_voxel_matrix(mri_img, pet_img)
+    return resample(voi_data, vox_map, pet_img.shape) > 0
+
+def compute_mean_suvr(pet, masks, stats=("mean",)):
+    """Compute ``stats`` of an already loaded PET inside every mask."""
+    return mask_stats(pet, masks, stats)
+
+_VOIS = {}
+
+def load_vois(voi_folder):
+    """Standard-space VOIs, loaded once per worker process."""
+    if voi_folder not in _VOIS:
+        imgs = {v: nib.load(os.path.join(voi_folder, v)) for v in VOI_FILES}
+        _VOIS[voi_folder] = (imgs, {v: img.get_fdata(dtype=np.float32) for v, img in imgs.items()})
+    return _VOIS[voi_folder]
+
+def process_subject(subj_id, args):
+    """Register, resample VOIs and compute SUVRs for one subject.
+
+    Returns the CSV row, or None if the subject has no MRI.
+    """
+    subj_folder = os.path.join(args.ref, subj_id)
+
+    # Hardcoded MR selection
+    mr_files = [f for f in os.listdir(subj_folder) if f.startswith("MR") and (f.endswith(".nii") or f.endswith(".nii.gz"))]
+    if len(mr_files) == 0:
+        print(f"⚠️ No MRI found for {subj_id}, skipping.")
+        return None
+    subj_mri_path = os.path.join(subj_folder, mr_files[0])
+
+    subj_outdir = os.path.join(args.out, subj_id)
+    os.makedirs(subj_outdir, exist_ok=True)
+
+    print(f"\nProcessing subject {subj_id}...")
+    voi_imgs, voi_data = load_vois(args.voi)
+
+    # Step 1: Register T1 template to subject T1 (skipped if already done)
+    flirt_omat = os.path.join(subj_outdir, "VOIs2subj.mat")
+    t1_out = os.path.join(subj_outdir, "T1_std2subj.nii.gz") if args.keep_intermediates else None
+    if valid_matrix(flirt_omat) and (t1_out is None or os.path.exists(t1_out)):
+        print(f"✅ Skipping step: {os.path.basename(flirt_omat)} already exists.")
     else:
-        return np.nan
+        flirt_register(os.path.join(args.voi, "T1_std.nii.gz"), subj_mri_path, flirt_omat, t1_out)
+    mri_img = nib.load(subj_mri_path)
+
+    # Step 2: Compute SUVRs for each PET tracer (VOIs resampled in memory)
+    subj_result = {"SubjectID": subj_id}
+    for suffix in args.pet:
+        pet_file = os.path.join(subj_outdir, f"PET_{suffix}_pet_t1.nii.gz")
+        if os.path.exists(pet_file):
+            pet_img = nib.load(pet_file)
+            pet = pet_img.get_fdata(dtype=np.float32)
+            masks = [voi_to_pet(voi_imgs[v], voi_data[v], flirt_omat, mri_img, pet_img) for v in VOI_FILES]
+            if args.keep_intermediates:
+                for v, m in zip(VOI_FILES, masks):
+                    out = os.path.join(subj_outdir, v.replace(".nii.gz", f"_2PET_{suffix}.nii.gz"))
+                    if not os.path.exists(out):
+                        save_like(m, pet_img, out)
+
+            mean_target, mean_ref = compute_mean_suvr(pet, masks)["mean"]
+            suvr = mean_target / mean_ref if mean_ref != 0 else np.nan
+            subj_result[f"SUVR_{suffix}"] = suvr
+        else:
+            subj_result[f"SUVR_{suffix}"] = np.nan
+
+    return subj_result
+
+def completed_rows(csv_file, fieldnames):
+    """Rows of an earlier run, keyed by subject.
+
+    A row is only written once its subject has finished, so every
+    complete row marks a finished subject, including ones with NaN
+    SUVRs (missing tracer, empty VOI). Delete a row to recompute it.
+    A last line cut off by a crash is ignored.
+    """
+    if not os.path.exists(csv_file):
+        return {}
+    with open(csv_file, newline="") as f:
+        lines = f.read().splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines = lines[:-1]
+    reader = csv.DictReader(lines)
+    if reader.fieldnames != fieldnames:
+        print(f"⚠️ {os.path.basename(csv_file)} has different columns, starting over.")
+        return {}
+    return {row["SubjectID"]: row for row in reader if None not in row.values()}
 
 def main():
     parser = argparse.ArgumentParser(description="VOI registration and SUVR pipeline")
@@ -60,84 +150,50 @@ def main():
     parser.add_argument("--voi", required=True, help="Folder with VOI_std.nii.gz, VOI_ref_std.nii.gz, T1_std.nii.gz")
     parser.add_argument("--out", required=True, help="Folder to store outputs")
     parser.add_argument("--pet", nargs="+", default=["PIB","FBB"], help="PET tracer suffixes in PET_<suffix>_pet_t1.nii.gz")
+    parser.add_argument("--keep-intermediates", action="store_true", help="Also write the registered T1 template and VOIs resampled to each PET")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of subjects processed in parallel")
     args = parser.parse_args()
 
-    ref_mri_folder = args.ref
-    voi_folder = args.voi
-    output_folder = args.out
-    pet_suffixes = args.pet
-
-    os.makedirs(output_folder, exist_ok=True)
-
-    voi_files = ["VOI_std.nii.gz", "VOI_ref_std.nii.gz"]
-
-    results = []
-
-    for subj_id in sorted(os.listdir(ref_mri_folder)):
-        subj_folder = os.path.join(ref_mri_folder, subj_id)
-        if not os.path.isdir(subj_folder):
-            continue
-
-        # Hardcoded MR selection
-        mr_files = [f for f in os.listdir(subj_folder) if f.startswith("MR") and (f.endswith(".nii") or f.endswith(".nii.gz"))]
-        if len(mr_files) == 0:
-            print(f"⚠️ No MRI found for {subj_id}, skipping.")
-            continue
-        subj_mri_path = os.path.join(subj_folder, mr_files[0])
-
-        subj_outdir = os.path.join(output_folder, subj_id)
-        os.makedirs(subj_outdir, exist_ok=True)
-
-        print(f"\nProcessing subject {subj_id}...")
-
-        # Step 1: Register T1 template to subject T1
-        flirt_omat = os.path.join(subj_outdir, "VOIs2subj.mat")
-        flirt_register(
-            os.path.join(voi_folder, "T1_std.nii.gz"),
-            subj_mri_path,
-            os.path.join(subj_outdir, "T1_std2subj.nii.gz"),
-            omat_file=flirt_omat
-        )
-
-        # Step 2: Apply transform to VOIs and binarize
-        voi_registered = {}
-        for voi in voi_files:
-            voi_in = os.path.join(voi_folder, voi)
-            voi_out = os.path.join(subj_outdir, voi.replace(".nii.gz","_2subj.nii.gz"))
-            flirt_register(voi_in, subj_mri_path, voi_out, omat_file=flirt_omat, applyxfm=True)
-
-            voi_bin_out = os.path.join(subj_outdir, voi.replace(".nii.gz","_2subj_bin.nii.gz"))
-            binarize_nifti(voi_out, voi_bin_out)
-            voi_registered[voi] = voi_bin_out
-
-        # Step 3: Compute SUVRs for each PET tracer
-        subj_result = {"SubjectID": subj_id}
-        for suffix in pet_suffixes:
-            pet_file = os.path.join(subj_outdir, f"PET_{suffix}_pet_t1.nii.gz")
-            if os.path.exists(pet_file):
-                # Resample VOIs to PET voxel grid
-                target_resampled = os.path.join(subj_outdir, f"VOI_std_2PET_{suffix}.nii.gz")
-                ref_resampled = os.path.join(subj_outdir, f"VOI_ref_std_2PET_{suffix}.nii.gz")
-                resample_to_pet(voi_registered["VOI_std.nii.gz"], pet_file, target_resampled)
-                resample_to_pet(voi_registered["VOI_ref_std.nii.gz"], pet_file, ref_resampled)
-
-                mean_target = compute_mean_suvr(pet_file, target_resampled)
-                mean_ref = compute_mean_suvr(pet_file, ref_resampled)
-                suvr = mean_target / mean_ref if mean_ref != 0 else np.nan
-                subj_result[f"SUVR_{suffix}"] = suvr
-            else:
-                subj_result[f"SUVR_{suffix}"] = np.nan
-
-        results.append(subj_result)
-
-    # Save CSV
-    csv_file = os.path.join(output_folder, "SUVR_results.csv")
-    fieldnames = ["SubjectID"] + [f"SUVR_{s}" for s in pet_suffixes]
-    with open(csv_file, "w", newline="") as f:
+    os.makedirs(args.out, exist_ok=True)
+
+    csv_file = os.path.join(args.out, "SUVR_results.csv")
+    fieldnames = ["SubjectID"] + [f"SUVR_{s}" for s in args.pet]
+    done = completed_rows(csv_file, fieldnames)
+    if done:
+        print(f"Resuming: {len(done)} subjects already in {os.path.basename(csv_file)}")
+
+    subjects = [s for s in sorted(os.listdir(args.ref))
+                if os.path.isdir(os.path.join(args.ref, s)) and s not in done]
+
+    # Rewrite the finished rows to a temporary file and swap it in, so a
+    # crash here cannot lose them; then append each subject as it completes
+    tmp = csv_file + ".tmp"
+    with open(tmp, "w", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerows(results)
+        writer.writerows(done.values())
+    os.replace(tmp, csv_file)
 
+    with open(csv_file, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        failed = []
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {executor.submit(process_subject, subj, args): subj for subj in subjects}
+            for future in as_completed(futures):
+                subj = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    print(f"❌ {subj} failed: {e}")
+                    failed.append(subj)
+                    continue
+                if row is not None:
+                    writer.writerow(row)
+                    f.flush()
+                    print(f"✅ Finished {subj}")
+
+    if failed:
+        print("\nFailed subjects:", failed)
     print(f"\n✅ Finished. SUVRs saved to {csv_file}")
 
 if __name__ == "__main__":
@@ -10,9 +10,16 @@ Usage:
         --voi_ctx /path/to/CTX_target_mask.nii.gz \
         --voi_wc /path/to/WholeCerebellum_ref_mask.nii.gz
 
+The registrations of all subjects run as one task graph (see fsl_dag.py)
+sharing --slots CPU slots; a timing report is saved to scheduler_timing.csv.
+
+Add --cache-dir /path/to/step_cache to reuse FSL step outputs across runs
+and output folders (see step_cache.py), and --native_fwhm/--target_fwhm
+to smooth the PETs to a common resolution first (see pet_smooth.py).
+
 Requirements:
-    - FSL in PATH (fslreorient2std, flirt, fslmaths, fslstats)
-    - Python 3 with numpy, pandas, scipy
+    - FSL in PATH (fslreorient2std, flirt)
+    - Python 3 with numpy, pandas, scipy, nibabel
 """
 import os
 import glob
@@ -20,8 +27,19 @@ import subprocess
 import argparse
 import numpy as np
 import pandas as pd
-from scipy.stats import linregress
 import nibabel as nib
+from calibration_stats import calibrate, formula_lines
+from fsl_dag import Task, Scheduler
+from fsl_stats import masked_means
+from pet_smooth import harmonize
+from formula_registry import register_formula
+from step_cache import add_cache_args, cache_from_args, fsl_version
+
+# Shared FSL step cache (None = plain skip-if-exists behaviour)
+CACHE = None
+
+# Recorded with registered formulas; bump when processing changes results
+PIPELINE = "florbetaben_calibration/2"
 
 
 # ================================
@@ -34,8 +52,14 @@ def run_cmd(cmd):
 
 
 def safe_run_cmd(cmd, output_file):
-    """Run command only if output file does not already exist."""
-    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+    """Run command only if output file does not already exist.
+
+    With --cache-dir the step goes through the shared step cache instead,
+    which also reruns it when inputs, flags or the FSL version changed.
+    """
+    if CACHE is not None:
+        CACHE.run(cmd, output_file, run_cmd)
+    elif os.path.exists(output_file) and os.path.getsize(output_file) > 0:
         print(f"✅ Skipping step: {os.path.basename(output_file)} already exists.")
     else:
         run_cmd(cmd)
@@ -44,15 +68,22 @@ def safe_run_cmd(cmd, output_file):
 # ================================
 # Core processing steps
 # ================================
-def reorient_and_register(pet_img, t1_img, subj_out_dir, pet_prefix):
-    """Reorient PET to std and register directly to T1. Skip threshold/reslice."""
+def reorient_and_register(pet_img, t1_img, subj_out_dir, pet_prefix, smooth=None):
+    """Reorient PET to std and register directly to T1. Skip threshold/reslice.
+
+    ``smooth`` = (native FWHM, target FWHM, cache dir) harmonizes the PET
+    resolution before registration.
+    """
     os.makedirs(subj_out_dir, exist_ok=True)
 
     pet_std = os.path.join(subj_out_dir, f"{pet_prefix}_pet_std.nii.gz")
     pet_t1 = os.path.join(subj_out_dir, f"{pet_prefix}_pet_t1.nii.gz")
 
-    # Reorient and register
+    # Reorient, optionally smooth, and register
     safe_run_cmd(['fslreorient2std', pet_img, pet_std], pet_std)
+    if smooth:
+        native, target, cache_dir = smooth
+        pet_std = harmonize(pet_std, native, target, cache_dir=cache_dir)
     safe_run_cmd(['flirt', '-ref', t1_img, '-in', pet_std, '-out', pet_t1, '-v'], pet_t1)
 
     return pet_t1
@@ -72,14 +103,6 @@ def transform_mask_to_t1(mask_path, t1_img, subj_out_dir, prefix):
     return mask_t1
 
 
-def extract_mean_in_mask(img, mask):
-    """Compute mean uptake in mask using fslstats."""
-    try:
-        out = subprocess.check_output(['fslstats', img, '-k', mask, '-M'])
-        return float(out.decode().strip())
-    except subprocess.CalledProcessError:
-        return np.nan
-
 
 def check_same_grid(img1, img2):
     """Return True if img1 and img2 have same grid size and voxel size."""
@@ -89,58 +112,104 @@ def check_same_grid(img1, img2):
 
 
 # ================================
-# Main analysis
+# Per-subject task graph
 # ================================
-def main(args):
-    os.makedirs(args.outdir, exist_ok=True)
-
-    subj_dirs = sorted(glob.glob(os.path.join(args.root, "*")))
-    rows = []
-
-    for subj_path in subj_dirs:
-        subj_id = os.path.basename(subj_path)
-        print(f"\n=== Processing subject: {subj_id} ===")
-
-        subj_out_dir = os.path.join(args.outdir, subj_id)
-        os.makedirs(subj_out_dir, exist_ok=True)
+# (CPU slots held, expected seconds) per step; see fsl_dag.py
+STEP_COST = {
+    "pet_reg": (1, 60),
+    "mask_reg": (1, 10),
+    "roi_means": (1, 5),
+}
+
+def find_subject_files(subj_path):
+    fbb = glob.glob(os.path.join(subj_path, "**", "*FBB*.nii*"), recursive=True)
+    pib = glob.glob(os.path.join(subj_path, "**", "*PIB*.nii*"), recursive=True)
+    t1 = glob.glob(os.path.join(subj_path, "**", "*MR*.nii*"), recursive=True) + \
+         glob.glob(os.path.join(subj_path, "**", "*t1*.nii*"), recursive=True)
+    return fbb, pib, t1
+
+def subject_roi_means(subj_id, fbb_t1, pib_t1, voi_ctx_t1, voi_wc_t1):
+    """SUVR row for one subject (None if the PET and mask grids differ)."""
+    # Grid sanity check
+    if not check_same_grid(fbb_t1, voi_ctx_t1):
+        print(f"⚠️  Skipping {subj_id}: PET and mask grid mismatch.")
+        return None
+
+    # ROI means
+    # Each PET and mask is read once (same result as fslstats -k mask -M).
+    # A bad image (4D, grid mismatch) only costs this subject its SUVRs.
+    try:
+        (fbb_ctx_mean, fbb_ref_mean), (pib_ctx_mean, pib_ref_mean) = \
+            masked_means([fbb_t1, pib_t1], [voi_ctx_t1, voi_wc_t1])
+    except (ValueError, OSError) as e:
+        print(f"⚠️  ROI means failed for {subj_id}: {e}")
+        fbb_ctx_mean = fbb_ref_mean = pib_ctx_mean = pib_ref_mean = np.nan
+
+    fbb_suvr = fbb_ctx_mean / fbb_ref_mean if fbb_ref_mean > 0 else np.nan
+    pib_suvr = pib_ctx_mean / pib_ref_mean if pib_ref_mean > 0 else np.nan
+    return {"subj": subj_id, "fbb_suvr": fbb_suvr, "pib_suvr": pib_suvr}
+
+def add_subject_tasks(sched, subj_path, args, smooth=None):
+    """Add one subject's steps to the scheduler; returns the final task name.
+
+    reorient (+ smooth) + FLIRT FBB/PiB → T1   ┐
+    VOI ctx/wc → T1 (flirt -applyxfm)          ┴→ ROI means
+    """
+    subj_id = os.path.basename(subj_path)
+    fbb, pib, t1 = find_subject_files(subj_path)
+    if not fbb or not pib or not t1:
+        print(f"⚠️  Missing files for {subj_id}. Skipping.")
+        return None
+
+    subj_out_dir = os.path.join(args.outdir, subj_id)
+    os.makedirs(subj_out_dir, exist_ok=True)
 
-        # Locate files
-        fbb = glob.glob(os.path.join(subj_path, "**", "*FBB*.nii*"), recursive=True)
-        pib = glob.glob(os.path.join(subj_path, "**", "*PIB*.nii*"), recursive=True)
-        t1 = glob.glob(os.path.join(subj_path, "**", "*MR*.nii*"), recursive=True) + \
-             glob.glob(os.path.join(subj_path, "**", "*t1*.nii*"), recursive=True)
+    def task(step, kind, func, *fargs, deps=()):
+        slots, est = STEP_COST[kind]
+        sched.add(Task(f"{subj_id}:{step}", func, fargs,
+                       [f"{subj_id}:{d}" for d in deps], slots, est, kind))
+        return f"{subj_id}:{step}"
 
-        if not fbb or not pib or not t1:
-            print(f"⚠️  Missing files for {subj_id}. Skipping.")
-            continue
+    # Registration (T1 space); the output paths are fixed by the prefix
+    task("pet_fbb", "pet_reg", reorient_and_register, fbb[0], t1[0], subj_out_dir, "PET_FBB", smooth)
+    task("pet_pib", "pet_reg", reorient_and_register, pib[0], t1[0], subj_out_dir, "PET_PIB", smooth)
+    fbb_t1 = os.path.join(subj_out_dir, "PET_FBB_pet_t1.nii.gz")
+    pib_t1 = os.path.join(subj_out_dir, "PET_PIB_pet_t1.nii.gz")
 
-        # Registration (T1 space)
-        fbb_t1 = reorient_and_register(fbb[0], t1[0], subj_out_dir, "PET_FBB")
-        pib_t1 = reorient_and_register(pib[0], t1[0], subj_out_dir, "PET_PIB")
+    # Resample VOIs to T1 space (once per subject)
+    task("mask_ctx", "mask_reg", transform_mask_to_t1, args.voi_ctx, t1[0], subj_out_dir, "ctx")
+    task("mask_wc", "mask_reg", transform_mask_to_t1, args.voi_wc, t1[0], subj_out_dir, "wc")
+    voi_ctx_t1 = os.path.join(subj_out_dir, "ctx_mask_t1.nii.gz")
+    voi_wc_t1 = os.path.join(subj_out_dir, "wc_mask_t1.nii.gz")
 
-        # Resample VOIs to T1 space (once per subject)
-        voi_ctx_t1 = transform_mask_to_t1(args.voi_ctx, t1[0], subj_out_dir, "ctx")
-        voi_wc_t1 = transform_mask_to_t1(args.voi_wc, t1[0], subj_out_dir, "wc")
+    return task("roi_means", "roi_means", subject_roi_means, subj_id, fbb_t1, pib_t1,
+                voi_ctx_t1, voi_wc_t1, deps=["pet_fbb", "pet_pib", "mask_ctx", "mask_wc"])
 
-        # Grid sanity check
-        if not check_same_grid(fbb_t1, voi_ctx_t1):
-            print(f"⚠️  Skipping {subj_id}: PET and mask grid mismatch.")
-            continue
+# ================================
+# Main analysis
+# ================================
+def main(args):
+    global CACHE
+    os.makedirs(args.outdir, exist_ok=True)
+    CACHE = cache_from_args(args)
+    smooth = None
+    if args.target_fwhm is not None:
+        if args.native_fwhm is None:
+            raise ValueError("--target_fwhm needs --native_fwhm")
+        smooth = (args.native_fwhm, args.target_fwhm, args.smooth_cache)
 
-        # ROI means
-        fbb_ctx_mean = extract_mean_in_mask(fbb_t1, voi_ctx_t1)
-        fbb_ref_mean = extract_mean_in_mask(fbb_t1, voi_wc_t1)
-        pib_ctx_mean = extract_mean_in_mask(pib_t1, voi_ctx_t1)
-        pib_ref_mean = extract_mean_in_mask(pib_t1, voi_wc_t1)
+    subj_dirs = sorted(glob.glob(os.path.join(args.root, "*")))
 
-        fbb_suvr = fbb_ctx_mean / fbb_ref_mean if fbb_ref_mean > 0 else np.nan
-        pib_suvr = pib_ctx_mean / pib_ref_mean if pib_ref_mean > 0 else np.nan
+    # One scheduler for the whole cohort: FSL steps of all subjects share the CPU slots
+    sched = Scheduler(args.slots)
+    finals = [add_subject_tasks(sched, subj, args, smooth) for subj in subj_dirs]
+    results = sched.run()
+    rows = [results[name] for name in finals if name and results[name]]
+    sched.report(os.path.join(args.outdir, "scheduler_timing.csv"))
 
-        rows.append({
-            "subj": subj_id,
-            "fbb_suvr": fbb_suvr,
-            "pib_suvr": pib_suvr
-        })
+    if CACHE is not None:
+        CACHE.evict()
+        CACHE.report()
 
     # ================================
     # SUVR analysis and calibration
@@ -155,25 +224,18 @@ def main(args):
         print("❌ No valid SUVR pairs found.")
         return
 
-    # Linear regression
-    slope, intercept, r, p, se = linregress(df_good['fbb_suvr'], df_good['pib_suvr'])
-    print(f"\n📈 Regression: PiB_calc = {slope:.4f} * FBB_SUVR + {intercept:.4f} (R²={r**2:.3f})")
-
-    df_good['pib_calc'] = slope * df_good['fbb_suvr'] + intercept
-
-    # YC/AD estimation
+    # YC/AD groups
     yc_mask = df_good['subj'].str.contains("YC", case=False)
     ad_mask = df_good['subj'].str.contains("E", case=False)
 
-    mean_pib_yc = df_good.loc[yc_mask, 'pib_suvr'].mean()
-    mean_pib_ad = df_good.loc[ad_mask, 'pib_suvr'].mean()
-    if np.isnan(mean_pib_yc) or np.isnan(mean_pib_ad):
-        mean_pib_yc = df_good['pib_suvr'].quantile(0.1)
-        mean_pib_ad = df_good['pib_suvr'].quantile(0.9)
+    # Linear regression, Centiloid coefficients and their uncertainty
+    cal = calibrate(df_good['fbb_suvr'], df_good['pib_suvr'], yc_mask, ad_mask, args.n_boot)
+    slope, intercept, A, B = cal['slope'], cal['intercept'], cal['A'], cal['B']
+    mean_pib_yc, mean_pib_ad = cal['mean_yc'], cal['mean_ad']
+    print(f"\n📈 Regression: PiB_calc = {slope:.4f} * FBB_SUVR + {intercept:.4f} (R²={cal['r']**2:.3f})")
 
-    # Centiloid coefficients
-    A = 100 * slope / (mean_pib_ad - mean_pib_yc)
-    B = 100 * (intercept - mean_pib_yc) / (mean_pib_ad - mean_pib_yc)
+    df_good['pib_calc'] = slope * df_good['fbb_suvr'] + intercept
+    df_good['pib_loo_resid'] = cal['loo_resid']
 
     df_good['centiloid'] = A * df_good['fbb_suvr'] + B
     results_csv = os.path.join(args.outdir, "calibration_results.csv")
@@ -189,9 +251,23 @@ def main(args):
         f.write(f"B = {B:.6f}\n")
         f.write(f"# slope (PiB_calc) = {slope:.6f}, intercept = {intercept:.6f}\n")
         f.write(f"# PiB mean YC = {mean_pib_yc:.6f}, PiB mean AD = {mean_pib_ad:.6f}\n")
+        f.writelines(formula_lines(cal))
+
+    if args.registry:
+        provenance = {
+            "script": os.path.basename(__file__), "root": os.path.abspath(args.root),
+            "vois": {'ctx': args.voi_ctx, 'ref': args.voi_wc}, "fsl_version": fsl_version(),
+            "slope": slope, "intercept": intercept, "pib_mean_yc": mean_pib_yc, "pib_mean_ad": mean_pib_ad,
+            **{k: cal[k] for k in ("n", "r", "loo_rmse", "A_ci", "B_ci", "slope_ci", "intercept_ci") if k in cal},
+        }
+        register_formula(args.registry, "FBB", args.voi_set, PIPELINE, A, B, provenance)
+        print(f"📒 Registered FBB/{args.voi_set}/{PIPELINE} in {args.registry}")
 
     print(f"\n✅ Saved Centiloid conversion formula to: {formula_path}")
     print(f"   CL = {A:.3f} × FBB_SUVR + {B:.3f}")
+    if 'A_ci' in cal:
+        print(f"   A {cal['ci']:g}% CI [{cal['A_ci'][0]:.3f}, {cal['A_ci'][1]:.3f}], "
+              f"B {cal['ci']:g}% CI [{cal['B_ci'][0]:.3f}, {cal['B_ci'][1]:.3f}]")
 
 
 # ================================
@@ -203,5 +279,13 @@ if __name__ == "__main__":
     parser.add_argument("--outdir", required=True, help="Output directory for results")
     parser.add_argument("--voi_ctx", required=True, help="Path to cortical target VOI mask")
     parser.add_argument("--voi_wc", required=True, help="Path to whole cerebellum VOI mask")
+    parser.add_argument("--slots", type=int, default=None, help="CPU slots shared by all FSL steps (default: core count)")
+    parser.add_argument("--n_boot", type=int, default=10000, help="Bootstrap resamples for the CIs (0 = none)")
+    parser.add_argument("--native_fwhm", type=float, nargs="+", help="Native PET resolution, FWHM mm (1 or 3 values)")
+    parser.add_argument("--target_fwhm", type=float, nargs="+", help="Smooth PETs to this FWHM mm before registration")
+    parser.add_argument("--smooth_cache", help="Shared directory for cached smoothed PETs")
+    parser.add_argument("--registry", help="Also store the formula in this registry JSON")
+    parser.add_argument("--voi_set", default="GAAIN", help="VOI set name recorded in the registry")
+    add_cache_args(parser)
     args = parser.parse_args()
     main(args)
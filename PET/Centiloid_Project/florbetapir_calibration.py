@@ -9,23 +9,47 @@ Workflow:
 3. Register PETs (FBP & PiB) to T1 space.
 4. Compute SUVRs and Centiloids.
 
+Steps 1-3 of every subject form one task graph (see fsl_dag.py). The PET
+registrations run while FNIRT is busy, and all subjects share --slots
+CPU slots. A critical-path timing report is printed and saved to
+scheduler_timing.csv. With --region_suvr each target VOI also gets its
+own SUVR columns. --native_fwhm/--target_fwhm smooth the PETs to a common
+resolution first (see pet_smooth.py). VOIs are warped with applywarp;
+--inprocess_warp uses fsl_warp.py instead (check it with check_fsl_warp.py).
+
 Usage:
     python centiloid_calibration_fbp.py \
         --root /path/to/GAAIN/FBP_project_root \
         --outdir /path/to/output_centiloid_fbp \
         --voi_targets /path/to/AVID_VOIs/Target\ Regions \
         --voi_ref /path/to/AVID_VOIs/Reference\ Region/cere_all.nii.gz
+
+Add --cache-dir /path/to/step_cache to reuse FSL step outputs across runs
+and output folders (see step_cache.py).
 """
 
 import os
 import glob
+import json
 import subprocess
 import argparse
 import numpy as np
 import pandas as pd
 import nibabel as nib
-from scipy.stats import linregress
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from calibration_stats import calibrate, formula_lines
+from fsl_affine import same_grid, save_like
+from fsl_dag import Task, Scheduler
+from fsl_stats import masked_means, label_means
+from fsl_warp import apply_warp
+from pet_smooth import harmonize
+from formula_registry import register_formula
+from step_cache import add_cache_args, cache_from_args, fsl_version
+
+# Shared FSL step cache (None = plain skip-if-exists behaviour)
+CACHE = None
+
+# Recorded with registered formulas; bump when processing changes results
+PIPELINE = "florbetapir_calibration/2"
 
 # ================================
 # Utility functions
@@ -35,6 +59,9 @@ def run_cmd(cmd):
     subprocess.check_call(cmd)
 
 def safe_run_cmd(cmd, outfile=None):
+    if CACHE is not None and outfile:
+        CACHE.run(cmd, outfile, run_cmd)
+        return
     if outfile and os.path.exists(outfile):
         print(f"✅ Skipping step: {os.path.basename(outfile)} already exists.")
         return
@@ -44,27 +71,68 @@ def truncate_4d_to_3d(img_path, out_path):
     img = nib.load(img_path)
     if len(img.shape) == 4:
         print(f"⚠️  {os.path.basename(img_path)} is 4D, truncating to first volume")
-        img_3d = nib.Nifti1Image(img.dataobj[..., 0], img.affine, img.header)
-        nib.save(img_3d, out_path)
+        img_3d = nib.Nifti1Image(np.asarray(img.dataobj[..., 0]), img.affine, img.header)
+        # Write a new file and swap it in: out_path may be hardlinked from the step cache
+        head, name = os.path.split(out_path)
+        tmp_path = os.path.join(head, name.replace(".nii", ".tmp.nii", 1))
+        nib.save(img_3d, tmp_path)
+        os.replace(tmp_path, out_path)
     else:
         if img_path != out_path:
             run_cmd(['cp', img_path, out_path])
 
-def merge_target_vois(target_dir, out_mask):
+def labels_json(labels_path):
+    """Sidecar {label: VOI name} next to a label image (file name only)."""
+    head, name = os.path.split(labels_path)
+    return os.path.join(head, name.replace(".nii.gz", "").replace(".nii", "") + ".json")
+
+def voi_name(path):
+    return os.path.basename(path).replace(".nii.gz", "").replace(".nii", "")
+
+def merge_target_vois(target_dir, out_mask, out_labels=None):
+    """Union of all target VOIs in one pass; the input VOIs are not modified.
+
+    With ``out_labels`` a label image (VOI i -> label i+1, first VOI wins
+    where they overlap) and a JSON {label: VOI name} are also written, so
+    per-region SUVRs can be read from the same warped image.
+    """
     voi_list = sorted(glob.glob(os.path.join(target_dir, "*.nii*")))
     if not voi_list:
         raise FileNotFoundError(f"No VOIs found in {target_dir}")
     print(f"🧩 Merging {len(voi_list)} target VOIs into one composite mask")
-    tmp = voi_list[0]
-    for voi in voi_list[1:]:
-        run_cmd(['fslmaths', tmp, '-add', voi, tmp])
-    run_cmd(['fslmaths', tmp, '-bin', out_mask])
+
+    ref = nib.load(voi_list[0])
+    union = np.zeros(ref.shape[:3], dtype=np.uint8)
+    label_dtype = np.uint8 if len(voi_list) < 256 else np.uint16
+    labels = np.zeros(ref.shape[:3], dtype=label_dtype) if out_labels else None
+    for i, voi in enumerate(voi_list):
+        img = nib.load(voi)
+        if not same_grid(img, ref):
+            raise ValueError(f"{os.path.basename(voi)} is not on the grid of {os.path.basename(voi_list[0])}")
+        roi = np.asarray(img.dataobj) > 0
+        if labels is not None:
+            labels[roi & (labels == 0)] = i + 1
+        union |= roi
+
+    save_like(union, ref, out_mask)
+    if labels is not None:
+        save_like(labels, ref, out_labels, dtype=label_dtype)
+        names = {i + 1: voi_name(v) for i, v in enumerate(voi_list)}
+        with open(labels_json(out_labels), "w") as f:
+            json.dump(names, f, indent=2)
     return out_mask
 
-def pet_registration(pet_img, t1_img, pet_std, pet_t1):
-    """Reorient and register PET directly to T1 (no threshold/reslice)."""
+def pet_registration(pet_img, t1_img, pet_std, pet_t1, smooth=None):
+    """Reorient and register PET directly to T1 (no threshold/reslice).
+
+    ``smooth`` = (native FWHM, target FWHM, cache dir) harmonizes the PET
+    resolution on its native grid before registration.
+    """
     safe_run_cmd(['fslreorient2std', pet_img, pet_std], pet_std)
     truncate_4d_to_3d(pet_std, pet_std)
+    if smooth:
+        native, target, cache_dir = smooth
+        pet_std = harmonize(pet_std, native, target, cache_dir=cache_dir)
     safe_run_cmd(['flirt', '-ref', t1_img, '-in', pet_std, '-out', pet_t1], pet_t1)
     return pet_t1
 
@@ -99,25 +167,38 @@ def apply_warp_to_voi(voi_img, t1_img, warp_file, out_mask):
     ], out_mask)
     return out_mask
 
-def extract_mean_in_mask(img, mask):
-    """Compute mean uptake in mask using fslstats."""
-    try:
-        out = subprocess.check_output(['fslstats', img, '-k', mask, '-M'])
-        return float(out.decode().strip())
-    except subprocess.CalledProcessError:
-        return np.nan
+def warp_vois_to_t1(vois, t1_img, warp_file, out_masks):
+    """Apply the FNIRT warp to all VOIs in-process, reading the warp once (nn)."""
+    todo = [(v, o) for v, o in zip(vois, out_masks) if not os.path.exists(o)]
+    if todo:
+        print(f"CMD: fsl_warp {os.path.basename(warp_file)} -> {len(todo)} VOIs")
+        apply_warp(warp_file, t1_img, [v for v, _ in todo], [o for _, o in todo], interp="nn")
+    return out_masks
 
 # ================================
-# Wrapper to process a single subject
+# Per-subject task graph
 # ================================
-def process_single_subject(subj_path, merged_ctx_mni, args):
-    subj_id = os.path.basename(subj_path)
-    print(f"\n=== Processing subject: {subj_id} ===")
-
-    subj_out_dir = os.path.join(args.outdir, subj_id)
-    os.makedirs(subj_out_dir, exist_ok=True)
+# (CPU slots held, expected seconds) per step. The estimates only set the
+# start order; FNIRT holds two slots for its memory and run length.
+STEP_COST = {
+    "reorient": (1, 5),
+    "flirt_mni": (1, 60),
+    "fnirt": (2, 900),
+    "applywarp": (1, 10),
+    "warp_vois": (1, 20),
+    "pet_reg": (1, 60),
+    "roi_means": (1, 5),
+}
+
+def smoothing_args(args):
+    """(native, target, cache dir) for harmonize(), or None without --target_fwhm."""
+    if args.target_fwhm is None:
+        return None
+    if args.native_fwhm is None:
+        raise ValueError("--target_fwhm needs --native_fwhm")
+    return args.native_fwhm, args.target_fwhm, args.smooth_cache
 
-    # Find files
+def find_subject_files(subj_path):
     fbp = glob.glob(os.path.join(subj_path, "**", "*FBP*.nii*"), recursive=True) + \
           glob.glob(os.path.join(subj_path, "**", "*AV45*.nii*"), recursive=True) + \
           glob.glob(os.path.join(subj_path, "**", "*florbetapir*.nii*"), recursive=True)
@@ -125,75 +206,125 @@ def process_single_subject(subj_path, merged_ctx_mni, args):
     t1 = glob.glob(os.path.join(subj_path, "**", "*MRI*.nii*"), recursive=True) + \
          glob.glob(os.path.join(subj_path, "**", "*T1*.nii*"), recursive=True) + \
          glob.glob(os.path.join(subj_path, "**", "*mri*.nii*"), recursive=True)
+    return fbp, pib, t1
+
+def subject_roi_means(subj_id, fbp_pet_t1, pib_pet_t1, merged_ctx_t1, voi_ref_t1,
+                      labels_t1=None, region_names=None):
+    """SUVR row for one subject (None if its ROI means cannot be computed)."""
+    pets = [fbp_pet_t1, pib_pet_t1]
+    # Each PET and mask is read once (same result as fslstats -k mask -M).
+    # A bad image (empty mask, grid mismatch) only skips this subject.
+    try:
+        (fbp_ctx_mean, fbp_ref_mean), (pib_ctx_mean, pib_ref_mean) = \
+            masked_means(pets, [merged_ctx_t1, voi_ref_t1])
+        region = label_means(pets, labels_t1, sorted(region_names)) if labels_t1 else None
+    except (ValueError, OSError) as e:
+        print(f"⚠️  Skipping {subj_id}: ROI means failed ({e})")
+        return None
 
+    fbp_suvr = fbp_ctx_mean / fbp_ref_mean if fbp_ref_mean > 0 else np.nan
+    pib_suvr = pib_ctx_mean / pib_ref_mean if pib_ref_mean > 0 else np.nan
+    row = {"subj": subj_id, "fbp_suvr": fbp_suvr, "pib_suvr": pib_suvr}
+
+    if region is not None:
+        ids = sorted(region_names)
+        for tracer, ref_mean, vals in (("fbp", fbp_ref_mean, region[0]), ("pib", pib_ref_mean, region[1])):
+            for lab, val in zip(ids, vals):
+                row[f"{tracer}_suvr_{region_names[lab]}"] = val / ref_mean if ref_mean > 0 else np.nan
+    return row
+
+def add_subject_tasks(sched, subj_path, merged_ctx_mni, args, labels_mni=None, region_names=None):
+    """Add one subject's steps to the scheduler; returns the final task name.
+
+    reorient T1 → FLIRT (MNI→T1) → FNIRT → warp VOIs (ctx, ref)  ┐
+    reorient FBP/PiB → PET→T1 FLIRT (run alongside FNIRT)       ┴→ ROI means
+    """
+    subj_id = os.path.basename(subj_path)
+    fbp, pib, t1 = find_subject_files(subj_path)
     if not fbp or not pib or not t1:
         print(f"⚠️  Missing files for {subj_id}. Skipping.")
         return None
 
-    # Reorient images
-    fbp_reor = os.path.join(subj_out_dir, "PET_FBP_reor.nii.gz")
-    pib_reor = os.path.join(subj_out_dir, "PET_PIB_reor.nii.gz")
-    t1_reor = os.path.join(subj_out_dir, "T1_reor.nii.gz")
-    safe_run_cmd(['fslreorient2std', fbp[0], fbp_reor], fbp_reor)
-    safe_run_cmd(['fslreorient2std', pib[0], pib_reor], pib_reor)
-    safe_run_cmd(['fslreorient2std', t1[0], t1_reor], t1_reor)
-
-    # Step 1: MNI -> T1 warp
-    affine_file = os.path.join(subj_out_dir, "mni2t1_affine.mat")
-    warp_file = os.path.join(subj_out_dir, "mni2t1_warp.nii.gz")
-    mni_template = '/usr/local/fsl/data/standard/MNI152_T1_1mm.nii.gz'
-    linear_flirt_mni_to_t1(mni_template, t1_reor, affine_file)
-    nonlinear_fnirt_mni_to_t1(mni_template, t1_reor, affine_file, warp_file)
-
-    # Apply warp to VOIs
-    merged_ctx_t1 = os.path.join(subj_out_dir, "composite_ctx_mask_T1.nii.gz")
-    voi_ref_t1 = os.path.join(subj_out_dir, "voi_ref_T1.nii.gz")
-    apply_warp_to_voi(merged_ctx_mni, t1_reor, warp_file, merged_ctx_t1)
-    apply_warp_to_voi(args.voi_ref, t1_reor, warp_file, voi_ref_t1)
-
-    # Step 2: Register PETs to T1
-    fbp_pet_t1 = pet_registration(fbp_reor, t1_reor,
-                                  os.path.join(subj_out_dir, "PET_FBP_pet_std.nii.gz"),
-                                  os.path.join(subj_out_dir, "PET_FBP_pet_t1.nii.gz"))
-    pib_pet_t1 = pet_registration(pib_reor, t1_reor,
-                                  os.path.join(subj_out_dir, "PET_PIB_pet_std.nii.gz"),
-                                  os.path.join(subj_out_dir, "PET_PIB_pet_t1.nii.gz"))
-
-    # Step 3: Compute ROI means
-    fbp_ctx_mean = extract_mean_in_mask(fbp_pet_t1, merged_ctx_t1)
-    fbp_ref_mean = extract_mean_in_mask(fbp_pet_t1, voi_ref_t1)
-    pib_ctx_mean = extract_mean_in_mask(pib_pet_t1, merged_ctx_t1)
-    pib_ref_mean = extract_mean_in_mask(pib_pet_t1, voi_ref_t1)
+    subj_out_dir = os.path.join(args.outdir, subj_id)
+    os.makedirs(subj_out_dir, exist_ok=True)
+    out = lambda name: os.path.join(subj_out_dir, name)
 
-    fbp_suvr = fbp_ctx_mean / fbp_ref_mean if fbp_ref_mean > 0 else np.nan
-    pib_suvr = pib_ctx_mean / pib_ref_mean if pib_ref_mean > 0 else np.nan
+    def task(step, kind, func, *fargs, deps=()):
+        slots, est = STEP_COST[kind]
+        sched.add(Task(f"{subj_id}:{step}", func, fargs,
+                       [f"{subj_id}:{d}" for d in deps], slots, est, kind))
+        return f"{subj_id}:{step}"
 
-    return {"subj": subj_id, "fbp_suvr": fbp_suvr, "pib_suvr": pib_suvr}
+    fbp_reor, pib_reor, t1_reor = out("PET_FBP_reor.nii.gz"), out("PET_PIB_reor.nii.gz"), out("T1_reor.nii.gz")
+    for step, src, dst in (("reor_fbp", fbp[0], fbp_reor), ("reor_pib", pib[0], pib_reor),
+                           ("reor_t1", t1[0], t1_reor)):
+        task(step, "reorient", safe_run_cmd, ['fslreorient2std', src, dst], dst)
+
+    # MNI -> T1 warp
+    affine_file, warp_file = out("mni2t1_affine.mat"), out("mni2t1_warp.nii.gz")
+    mni_template = '/usr/local/fsl/data/standard/MNI152_T1_1mm.nii.gz'
+    task("flirt_mni", "flirt_mni", linear_flirt_mni_to_t1, mni_template, t1_reor, affine_file,
+         deps=["reor_t1"])
+    task("fnirt", "fnirt", nonlinear_fnirt_mni_to_t1, mni_template, t1_reor, affine_file, warp_file,
+         deps=["flirt_mni"])
+
+    # VOIs to T1 (plus the optional per-region target labels)
+    merged_ctx_t1, voi_ref_t1 = out("composite_ctx_mask_T1.nii.gz"), out("voi_ref_T1.nii.gz")
+    labels_t1 = out("target_labels_T1.nii.gz") if labels_mni else None
+    vois = [(merged_ctx_mni, merged_ctx_t1), (args.voi_ref, voi_ref_t1)]
+    if labels_mni:
+        vois.append((labels_mni, labels_t1))
+    if not args.inprocess_warp:
+        for step, (src, dst) in zip(("warp_ctx", "warp_ref", "warp_labels"), vois):
+            task(step, "applywarp", apply_warp_to_voi, src, t1_reor, warp_file, dst, deps=["fnirt"])
+        warp_steps = ["warp_ctx", "warp_ref", "warp_labels"][:len(vois)]
+    else:
+        task("warp_vois", "warp_vois", warp_vois_to_t1, [v for v, _ in vois], t1_reor, warp_file,
+             [o for _, o in vois], deps=["fnirt"])
+        warp_steps = ["warp_vois"]
+
+    # PETs to T1, independent of the warp
+    fbp_pet_t1, pib_pet_t1 = out("PET_FBP_pet_t1.nii.gz"), out("PET_PIB_pet_t1.nii.gz")
+    smooth = smoothing_args(args)
+    task("pet_fbp", "pet_reg", pet_registration, fbp_reor, t1_reor, out("PET_FBP_pet_std.nii.gz"),
+         fbp_pet_t1, smooth, deps=["reor_fbp", "reor_t1"])
+    task("pet_pib", "pet_reg", pet_registration, pib_reor, t1_reor, out("PET_PIB_pet_std.nii.gz"),
+         pib_pet_t1, smooth, deps=["reor_pib", "reor_t1"])
+
+    deps = warp_steps + ["pet_fbp", "pet_pib"]
+    return task("roi_means", "roi_means", subject_roi_means, subj_id, fbp_pet_t1, pib_pet_t1,
+                merged_ctx_t1, voi_ref_t1, labels_t1, region_names, deps=deps)
 
 # ================================
 # Main analysis
 # ================================
 def main(args):
+    global CACHE
     os.makedirs(args.outdir, exist_ok=True)
+    CACHE = cache_from_args(args)
 
     # Merge target VOIs once (MNI space)
     merged_ctx_mni = os.path.join(args.outdir, "composite_ctx_mask_MNI.nii.gz")
-    if not os.path.exists(merged_ctx_mni):
-        merge_target_vois(args.voi_targets, merged_ctx_mni)
+    labels_mni = os.path.join(args.outdir, "target_labels_MNI.nii.gz") if args.region_suvr else None
+    merge_target_vois(args.voi_targets, merged_ctx_mni, labels_mni)
+    region_names = None
+    if labels_mni:
+        with open(labels_json(labels_mni)) as f:
+            region_names = {int(k): v for k, v in json.load(f).items()}
 
     subj_dirs = sorted(glob.glob(os.path.join(args.root, "*")))
-    rows = []
 
-    # Process subjects in parallel
-    with ProcessPoolExecutor(max_workers=4) as executor:
-        futures = {executor.submit(process_single_subject, subj, merged_ctx_mni, args): subj
-                   for subj in subj_dirs}
+    # One scheduler for the whole cohort: FSL steps of all subjects share the CPU slots
+    sched = Scheduler(args.slots)
+    finals = [add_subject_tasks(sched, subj, merged_ctx_mni, args, labels_mni, region_names)
+              for subj in subj_dirs]
+    results = sched.run()
+    rows = [results[name] for name in finals if name and results[name]]
+    sched.report(os.path.join(args.outdir, "scheduler_timing.csv"))
 
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                rows.append(result)
-                print(f"✅ Finished {result['subj']}")
+    if CACHE is not None:
+        CACHE.evict()
+        CACHE.report()
 
     # SUVR analysis & Centiloid calculation (unchanged)
     df = pd.DataFrame(rows)
@@ -204,20 +335,16 @@ def main(args):
         print("❌ No valid SUVR pairs found.")
         return
 
-    slope, intercept, r, p, se = linregress(df_good['fbp_suvr'], df_good['pib_suvr'])
-    df_good['pib_calc'] = slope * df_good['fbp_suvr'] + intercept
-
     yc_mask = df_good['subj'].str.contains("YC", case=False)
     ad_mask = df_good['subj'].str.contains("E", case=False)
 
-    mean_pib_yc = df_good.loc[yc_mask, 'pib_suvr'].mean()
-    mean_pib_ad = df_good.loc[ad_mask, 'pib_suvr'].mean()
-    if np.isnan(mean_pib_yc) or np.isnan(mean_pib_ad):
-        mean_pib_yc = df_good['pib_suvr'].quantile(0.1)
-        mean_pib_ad = df_good['pib_suvr'].quantile(0.9)
+    # Regression, Centiloid coefficients and their uncertainty
+    cal = calibrate(df_good['fbp_suvr'], df_good['pib_suvr'], yc_mask, ad_mask, args.n_boot)
+    slope, intercept, A, B = cal['slope'], cal['intercept'], cal['A'], cal['B']
+    mean_pib_yc, mean_pib_ad = cal['mean_yc'], cal['mean_ad']
+    df_good['pib_calc'] = slope * df_good['fbp_suvr'] + intercept
+    df_good['pib_loo_resid'] = cal['loo_resid']
 
-    A = 100 * slope / (mean_pib_ad - mean_pib_yc)
-    B = 100 * (intercept - mean_pib_yc) / (mean_pib_ad - mean_pib_yc)
     df_good['centiloid'] = A * df_good['fbp_suvr'] + B
 
     df_good.to_csv(os.path.join(args.outdir, "calibration_results.csv"), index=False)
@@ -230,9 +357,23 @@ def main(args):
         f.write(f"B = {B:.6f}\n")
         f.write(f"# slope (PiB_calc) = {slope:.6f}, intercept = {intercept:.6f}\n")
         f.write(f"# PiB mean YC = {mean_pib_yc:.6f}, PiB mean AD = {mean_pib_ad:.6f}\n")
+        f.writelines(formula_lines(cal))
+
+    if args.registry:
+        provenance = {
+            "script": os.path.basename(__file__), "root": os.path.abspath(args.root),
+            "vois": {'targets': args.voi_targets, 'ref': args.voi_ref}, "fsl_version": fsl_version(),
+            "slope": slope, "intercept": intercept, "pib_mean_yc": mean_pib_yc, "pib_mean_ad": mean_pib_ad,
+            **{k: cal[k] for k in ("n", "r", "loo_rmse", "A_ci", "B_ci", "slope_ci", "intercept_ci") if k in cal},
+        }
+        register_formula(args.registry, "FBP", args.voi_set, PIPELINE, A, B, provenance)
+        print(f"📒 Registered FBP/{args.voi_set}/{PIPELINE} in {args.registry}")
 
     print(f"\n✅ Saved Centiloid conversion formula to: {formula_path}")
     print(f"   CL = {A:.3f} × FBP_SUVR + {B:.3f}")
+    if 'A_ci' in cal:
+        print(f"   A {cal['ci']:g}% CI [{cal['A_ci'][0]:.3f}, {cal['A_ci'][1]:.3f}], "
+              f"B {cal['ci']:g}% CI [{cal['B_ci'][0]:.3f}, {cal['B_ci'][1]:.3f}]")
 
 # ================================
 # Entry point
@@ -243,5 +384,17 @@ if __name__ == "__main__":
     parser.add_argument("--outdir", required=True, help="Output directory for results")
     parser.add_argument("--voi_targets", required=True, help="Folder containing target VOIs (multiple .nii.gz)")
     parser.add_argument("--voi_ref", required=True, help="Path to reference VOI mask (e.g., cere_all.nii.gz)")
+    parser.add_argument("--region_suvr", action="store_true", help="Also report SUVRs for each target VOI")
+    parser.add_argument("--inprocess_warp", action="store_true",
+                        help="Warp VOIs in-process (fsl_warp.py) instead of FSL applywarp; "
+                             "validate with check_fsl_warp.py first")
+    parser.add_argument("--native_fwhm", type=float, nargs="+", help="Native PET resolution, FWHM mm (1 or 3 values)")
+    parser.add_argument("--target_fwhm", type=float, nargs="+", help="Smooth PETs to this FWHM mm before registration")
+    parser.add_argument("--smooth_cache", help="Shared directory for cached smoothed PETs")
+    parser.add_argument("--slots", type=int, default=None, help="CPU slots shared by all FSL steps (default: core count)")
+    parser.add_argument("--n_boot", type=int, default=10000, help="Bootstrap resamples for the CIs (0 = none)")
+    parser.add_argument("--registry", help="Also store the formula in this registry JSON")
+    parser.add_argument("--voi_set", default="AVID", help="VOI set name recorded in the registry")
+    add_cache_args(parser)
     args = parser.parse_args()
     main(args)
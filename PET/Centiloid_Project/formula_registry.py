@@ -0,0 +1,101 @@
+"""
+Machine-readable registry of Centiloid calibrations.
+
+One JSON file holds every calibration, keyed by tracer, VOI set and
+pipeline version:
+
+    {"formulas": [
+        {"tracer": "FBP", "voi_set": "AVID", "pipeline": "florbetapir_calibration/2",
+         "A": 183.07, "B": -177.26, "created": "2026-10-18T12:00:00",
+         "provenance": {"script": ..., "n": 46, "r": 0.98, "A_ci": [...], ...}},
+        ...]}
+
+Registering an existing key replaces that entry, and the old one is kept
+under "superseded". Writes are atomic: a temporary file is written and
+then os.replace()d.
+"""
+
+import os
+import re
+import json
+import datetime
+
+# Spellings seen in cohort tables -> registry tracer names
+TRACER_ALIASES = {
+    "FBP": "FBP", "AV45": "FBP", "FLORBETAPIR": "FBP", "AMYVID": "FBP",
+    "FBB": "FBB", "FLORBETABEN": "FBB", "NEURACEQ": "FBB",
+    "PIB": "PIB", "NAV": "NAV", "NAV4694": "NAV", "FMM": "FMM", "FLUTEMETAMOL": "FMM",
+}
+
+
+def normalize_tracer(name):
+    key = re.sub(r"[^A-Z0-9]", "", str(name).upper())
+    return TRACER_ALIASES.get(key, key)
+
+
+def load_registry(path):
+    if not os.path.exists(path):
+        return {"formulas": [], "superseded": []}
+    with open(path) as f:
+        reg = json.load(f)
+    reg.setdefault("formulas", [])
+    reg.setdefault("superseded", [])
+    return reg
+
+
+def register_formula(path, tracer, voi_set, pipeline, A, B, provenance=None):
+    """Add (or replace) one calibration in the registry at ``path``."""
+    reg = load_registry(path)
+    entry = {
+        "tracer": normalize_tracer(tracer), "voi_set": voi_set, "pipeline": pipeline,
+        "A": float(A), "B": float(B),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "provenance": provenance or {},
+    }
+    key = (entry["tracer"], voi_set, pipeline)
+    keep = []
+    for old in reg["formulas"]:
+        if (old["tracer"], old["voi_set"], old["pipeline"]) == key:
+            print(f"⚠️  Replacing registered {'/'.join(key)} formula from {old['created']}")
+            reg["superseded"].append(old)
+        else:
+            keep.append(old)
+    reg["formulas"] = keep + [entry]
+
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(reg, f, indent=2)
+    os.replace(tmp, path)
+    return entry
+
+
+def select_formulas(reg, voi_set=None, pipeline=None):
+    """{tracer: entry} for the requested VOI set / pipeline.
+
+    If a tracer has several matching entries (filters left open), the
+    most recently created one is used.
+    """
+    chosen = {}
+    for entry in reg["formulas"]:
+        if voi_set is not None and entry["voi_set"] != voi_set:
+            continue
+        if pipeline is not None and entry["pipeline"] != pipeline:
+            continue
+        prev = chosen.get(entry["tracer"])
+        if prev is None or entry["created"] > prev["created"]:
+            chosen[entry["tracer"]] = entry
+    return chosen
+
+
+def parse_formula_txt(path):
+    """Read A and B from a legacy centiloid_formula.txt."""
+    A, B = None, None
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("A"):
+                A = float(re.findall(r"[-+]?\d*\.\d+|\d+", line)[0])
+            elif line.startswith("B"):
+                B = float(re.findall(r"[-+]?\d*\.\d+|\d+", line)[0])
+    if A is None or B is None:
+        raise ValueError("Could not read A and B from formula file.")
+    return A, B
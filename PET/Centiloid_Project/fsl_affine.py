@@ -0,0 +1,58 @@
+"""
+In-process equivalents of FLIRT's -applyxfm / -usesqform resampling.
+
+FLIRT matrices map between "FSL scaled-mm" coordinates: voxel indices
+times voxel size, with x flipped for images stored in neurological order.
+Composing them with the images' sforms gives one voxel-to-voxel matrix,
+which scipy.ndimage.affine_transform applies without writing any
+intermediate file.
+"""
+
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import affine_transform
+
+
+def fsl_scaled_matrix(img):
+    """Voxel -> FSL scaled-mm matrix for an image (as FLIRT defines it)."""
+    zooms = np.asarray(img.header.get_zooms()[:3], dtype=float)
+    S = np.diag(np.append(zooms, 1.0))
+    if np.linalg.det(img.affine[:3, :3]) > 0:
+        # Neurological storage order: FSL flips x to radiological
+        S[0, 0] = -zooms[0]
+        S[0, 3] = (img.shape[0] - 1) * zooms[0]
+    return S
+
+
+def flirt_voxel_matrix(flirt_mat, src_img, ref_img):
+    """Ref voxel -> src voxel matrix for a FLIRT ``-omat`` (src -> ref)."""
+    M = np.loadtxt(flirt_mat) if isinstance(flirt_mat, str) else np.asarray(flirt_mat)
+    return np.linalg.inv(fsl_scaled_matrix(src_img)) @ np.linalg.inv(M) @ fsl_scaled_matrix(ref_img)
+
+
+def sform_voxel_matrix(src_img, ref_img):
+    """Ref voxel -> src voxel matrix through world space (``-usesqform``)."""
+    return np.linalg.inv(src_img.affine) @ ref_img.affine
+
+
+def resample(data, vox_map, out_shape, order=0):
+    """Resample ``data`` onto a grid given an output -> input voxel matrix.
+
+    ``order=0`` is nearest neighbour (FLIRT ``-interp nearestneighbour``),
+    ``order=1`` trilinear. Voxels that map outside ``data`` are set to 0.
+    """
+    return affine_transform(np.asarray(data, dtype=np.float32), vox_map,
+                            output_shape=tuple(out_shape[:3]), order=order,
+                            mode='constant', cval=0.0)
+
+
+def same_grid(a, b, atol=1e-3):
+    """True if two images share shape and voxel-to-world affine."""
+    return a.shape[:3] == b.shape[:3] and np.allclose(a.affine, b.affine, atol=atol)
+
+
+def save_like(data, ref_img, path, dtype=np.uint8):
+    """Write ``data`` on ``ref_img``'s grid (used for optional intermediates)."""
+    out = nib.Nifti1Image(np.asarray(data).astype(dtype), ref_img.affine, ref_img.header)
+    out.set_data_dtype(dtype)
+    nib.save(out, path)
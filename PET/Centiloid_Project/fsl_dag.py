@@ -0,0 +1,173 @@
+"""
+Cohort-wide scheduler for per-subject FSL task graphs.
+
+Each subject's pipeline is a set of Tasks with dependencies. Tasks from
+all subjects share one pool of CPU slots (default: the machine's core
+count). A task holds ``slots`` of them while it runs, so heavy steps
+can be given more weight than light ones.
+
+Ready tasks are started longest-remaining-path first. ``est`` is the
+expected runtime of a step, and chains that end in long steps such as
+FNIRT are started early. Short independent steps (the PET FLIRTs) fill
+the slots that are left over.
+
+FSL steps are subprocesses, so tasks run in threads. The GIL is released
+while a thread waits on its command.
+
+After a run, report() prints the critical path (the chain of tasks that
+determined the wall time) and the total time spent per step type.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+    """One pipeline step: ``func(*args)`` after all ``deps`` have finished."""
+
+    def __init__(self, name, func, args=(), deps=(), slots=1, est=1.0, kind=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.deps = list(deps)
+        self.slots = slots
+        self.est = est
+        self.kind = kind or name.rsplit(":", 1)[-1]
+        self.result = None
+        self.error = None
+        self.start = self.end = None
+
+
+class Scheduler:
+    def __init__(self, slots=None):
+        self.slots = slots or os.cpu_count() or 1
+        self.tasks = {}
+        self._t0 = None
+
+    def add(self, task):
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task name: {task.name}")
+        self.tasks[task.name] = task
+        return task
+
+    def _priorities(self):
+        """Longest estimated path from each task to the end of its graph."""
+        children = {name: [] for name in self.tasks}
+        for t in self.tasks.values():
+            for d in t.deps:
+                if d not in self.tasks:
+                    raise ValueError(f"Task {t.name} depends on unknown task {d}")
+                children[d].append(t.name)
+        rank = {}
+
+        def visit(name, stack=()):
+            if name in rank:
+                return rank[name]
+            if name in stack:
+                raise ValueError(f"Dependency cycle through {name}")
+            below = [visit(c, stack + (name,)) for c in children[name]]
+            rank[name] = self.tasks[name].est + max(below, default=0.0)
+            return rank[name]
+
+        for name in self.tasks:
+            visit(name)
+        return rank
+
+    def _run_task(self, task):
+        task.start = time.time() - self._t0
+        try:
+            task.result = task.func(*task.args)
+        except Exception as e:
+            task.error = e
+        task.end = time.time() - self._t0
+        return task
+
+    def run(self):
+        """Run every task. Returns {name: result} (None for failed/skipped)."""
+        rank = self._priorities()
+        waiting = {name: set(t.deps) for name, t in self.tasks.items()}
+        ready = [n for n, deps in waiting.items() if not deps]
+        for n in ready:
+            del waiting[n]
+        running = {}
+        free = self.slots
+        self._t0 = time.time()
+
+        def finish(task):
+            nonlocal free
+            if task.start is not None:
+                free += task.slots
+            if task.error is not None:
+                print(f"❌ {task.name} failed: {task.error}")
+            for name in list(waiting):
+                if task.name not in waiting[name]:
+                    continue
+                if task.error is not None:
+                    # Dependents of a failed step cannot run
+                    del waiting[name]
+                    self.tasks[name].error = RuntimeError(f"skipped, {task.name} failed")
+                    finish(self.tasks[name])
+                    continue
+                waiting[name].discard(task.name)
+                if not waiting[name]:
+                    del waiting[name]
+                    ready.append(name)
+
+        with ThreadPoolExecutor(max_workers=self.slots) as pool:
+            while ready or running:
+                ready.sort(key=lambda n: -rank[n])
+                for name in list(ready):
+                    task = self.tasks[name]
+                    # A task wider than the pool runs alone rather than never
+                    if task.slots <= free or not running:
+                        ready.remove(name)
+                        free -= task.slots
+                        running[pool.submit(self._run_task, task)] = task
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    finish(running.pop(fut))
+
+        return {name: t.result for name, t in self.tasks.items()}
+
+    # ---------- reporting ----------
+    def critical_path(self):
+        """Tasks ending at the last finish, each preceded by its latest dep."""
+        done = [t for t in self.tasks.values() if t.end is not None and t.start is not None]
+        if not done:
+            return []
+        task = max(done, key=lambda t: t.end)
+        path = [task]
+        while task.deps:
+            deps = [self.tasks[d] for d in task.deps if self.tasks[d].end is not None]
+            if not deps:
+                break
+            task = max(deps, key=lambda t: t.end)
+            path.append(task)
+        return path[::-1]
+
+    def report(self, csv_path=None):
+        """Print the critical path and per-step totals; optionally save timings."""
+        done = [t for t in self.tasks.values() if t.start is not None]
+        if not done:
+            return
+        wall = max(t.end for t in done)
+        print(f"\n⏱️  {len(done)} tasks in {wall / 60:.1f} min on {self.slots} slots")
+        print("   Critical path:")
+        for t in self.critical_path():
+            print(f"     {t.start:8.1f}s → {t.end:8.1f}s  {t.name}")
+
+        totals = {}
+        for t in done:
+            totals[t.kind] = totals.get(t.kind, 0.0) + (t.end - t.start)
+        busy = sum(totals.values()) or 1.0
+        print("   Time per step:")
+        for kind, secs in sorted(totals.items(), key=lambda kv: -kv[1]):
+            print(f"     {kind:<16s} {secs / 60:8.1f} min ({100 * secs / busy:.0f}%)")
+
+        if csv_path:
+            with open(csv_path, "w") as f:
+                f.write("task,kind,slots,start_s,end_s,status\n")
+                for t in sorted(done, key=lambda t: t.start):
+                    status = "ok" if t.error is None else "failed"
+                    f.write(f"{t.name},{t.kind},{t.slots},{t.start:.2f},{t.end:.2f},{status}\n")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Gaussian smoothing to harmonize PET resolution across scanners.
+
+A scan with native resolution F_native (FWHM, mm) reaches the target
+resolution F_target after smoothing with
+
+    F_extra = sqrt(F_target^2 - F_native^2)        (per axis)
+
+The kernel is separable, so x, y and z are filtered one after another in
+float32. Small kernels use direct 1D convolution. Kernels longer than
+FFT_TAPS use FFT convolution along that axis, which costs the same for
+any kernel length. Both use the same truncated, normalized kernel and
+zero padding (as fslmaths -s), so the two paths agree to rounding.
+
+The image is streamed in z-slabs. Each output slab needs its input slab
+plus a halo of kernel-radius slices, which is kept in a rolling window
+over nifti_stream.iter_slabs, so the input file is read exactly once.
+
+Results are cached: the output's JSON sidecar records the source file
+(path, size, mtime) and the kernel, and a matching sidecar skips the work.
+
+Usage:
+    python pet_smooth.py --in PET.nii.gz --out PET_s8.nii.gz --native 4.5 --target 8
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import convolve1d
+from scipy.signal import fftconvolve
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pet_suvr"))
+from nifti_stream import iter_slabs, SlabWriter  # noqa: E402
+
+FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+TRUNCATE = 4.0
+FFT_TAPS = 41
+
+
+def extra_fwhm(native, target):
+    """Per-axis FWHM (mm) that takes ``native`` to ``target`` resolution."""
+    native = np.broadcast_to(np.asarray(native, dtype=float), (3,))
+    target = np.broadcast_to(np.asarray(target, dtype=float), (3,))
+    if np.any(target < native):
+        print(f"⚠️  Target FWHM {target} is sharper than native {native}; those axes are left unsmoothed")
+    return np.sqrt(np.maximum(target ** 2 - native ** 2, 0.0))
+
+
+def gaussian_kernel(fwhm_mm, zoom):
+    """Normalized 1D kernel for one axis (None if nothing to do)."""
+    sigma = fwhm_mm * FWHM_TO_SIGMA / zoom
+    if sigma < 1e-3:
+        return None
+    radius = int(np.ceil(TRUNCATE * sigma))
+    x = np.arange(-radius, radius + 1)
+    k = np.exp(-0.5 * (x / sigma) ** 2)
+    return (k / k.sum()).astype(np.float32)
+
+
+def _filter(block, kernel, axis):
+    if kernel is None:
+        return block
+    if len(kernel) > FFT_TAPS:
+        shape = [1, 1, 1]
+        shape[axis] = len(kernel)
+        return fftconvolve(block, kernel.reshape(shape), mode='same', axes=axis).astype(np.float32)
+    return convolve1d(block, kernel, axis=axis, mode='constant', cval=0.0)
+
+
+def smooth_image(in_path, out_path, fwhm, slab=16):
+    """Smooth a 3D image by ``fwhm`` mm (scalar or per axis), slab by slab."""
+    img = nib.load(in_path)
+    if len(img.shape) != 3:
+        raise ValueError(f"{in_path} is not a 3D image: {img.shape}")
+    zooms = img.header.get_zooms()[:3]
+    fwhm = np.broadcast_to(np.asarray(fwhm, dtype=float), (3,))
+    kx, ky, kz = (gaussian_kernel(f, z) for f, z in zip(fwhm, zooms))
+    halo = len(kz) // 2 if kz is not None else 0
+    nz = img.shape[2]
+
+    # Rolling window of in-plane-filtered slices [w0, w0 + window.shape[2])
+    window = np.zeros(img.shape[:2] + (0,), dtype=np.float32)
+    w0 = 0
+    reader = iter_slabs(img, slab)
+    with SlabWriter(out_path, img.affine, img.header, img.shape) as w:
+        for z0 in range(0, nz, slab):
+            z1 = min(z0 + slab, nz)
+            while w0 + window.shape[2] < min(z1 + halo, nz):
+                _, _, block = next(reader)
+                block = _filter(_filter(block, kx, 0), ky, 1)
+                window = np.concatenate([window, block], axis=2)
+            # Zero-pad beyond the volume so every output slice sees a full kernel
+            lo, hi = z0 - halo, z1 + halo
+            part = window[:, :, max(lo, w0) - w0:min(hi, nz) - w0]
+            part = np.pad(part, ((0, 0), (0, 0), (max(lo, w0) - lo, hi - min(hi, nz))))
+            out = _filter(part, kz, 2)
+            w.write(out[:, :, halo:halo + (z1 - z0)])
+            # Keep only what the next slab's halo needs
+            drop = max(0, min(z1 - halo, nz) - w0)
+            window = window[:, :, drop:]
+            w0 += drop
+    return out_path
+
+
+def _with_suffix(path, suffix, ext=None):
+    """``path`` with ``suffix`` inserted before its NIfTI extension (file name only)."""
+    head, name = os.path.split(path)
+    ext_in = ".nii.gz" if name.endswith(".nii.gz") else os.path.splitext(name)[1]
+    stem = name[:len(name) - len(ext_in)] if ext_in else name
+    return os.path.join(head, stem + suffix + (ext_in if ext is None else ext))
+
+
+def cache_key(in_path, fwhm):
+    st = os.stat(in_path)
+    return {"source": os.path.realpath(in_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "fwhm_mm": [round(float(f), 4) for f in np.broadcast_to(fwhm, (3,))],
+            "truncate": TRUNCATE}
+
+
+def smooth_cached(in_path, fwhm, out_path=None, cache_dir=None, slab=16):
+    """Smooth unless an identical result exists; returns the output path.
+
+    With ``cache_dir`` the output is stored there under a hash of the key,
+    so identical requests from different pipelines share one file.
+    """
+    key = cache_key(in_path, fwhm)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+        out_path = os.path.join(cache_dir, f"{digest}.nii.gz")
+    sidecar = _with_suffix(out_path, "", ".json")
+    if os.path.exists(out_path) and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            if json.load(f) == key:
+                print(f"✅ Skipping smoothing: {os.path.basename(out_path)} is up to date")
+                return out_path
+
+    tmp = _with_suffix(out_path, ".tmp")
+    smooth_image(in_path, tmp, fwhm, slab)
+    os.replace(tmp, out_path)
+    with open(sidecar, "w") as f:
+        json.dump(key, f, indent=2)
+    return out_path
+
+
+def harmonize(in_path, native, target, out_path=None, cache_dir=None):
+    """Smooth ``in_path`` from ``native`` to ``target`` FWHM (returns input if no-op)."""
+    fwhm = extra_fwhm(native, target)
+    if not np.any(fwhm > 0):
+        return in_path
+    if out_path is None and cache_dir is None:
+        out_path = _with_suffix(in_path, f"_s{np.max(fwhm):.1f}mm")
+    print(f"🔧 Smoothing {os.path.basename(in_path)} by {np.round(fwhm, 2)} mm FWHM")
+    return smooth_cached(in_path, fwhm, out_path, cache_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smooth PET to a common resolution")
+    parser.add_argument("--in", dest="in_path", required=True, help="3D PET image")
+    parser.add_argument("--out", help="Output image (default: next to input or in --cache-dir)")
+    parser.add_argument("--native", type=float, nargs="+", required=True, help="Native FWHM mm (1 or 3 values)")
+    parser.add_argument("--target", type=float, nargs="+", required=True, help="Target FWHM mm (1 or 3 values)")
+    parser.add_argument("--cache-dir", help="Shared cache directory for smoothed images")
+    args = parser.parse_args()
+    print(harmonize(args.in_path, args.native, args.target, args.out, args.cache_dir))
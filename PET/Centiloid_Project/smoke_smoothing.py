@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Smoke run of the PET smoothing path (--native_fwhm/--target_fwhm with
+--smooth_cache) through both calibration drivers on a synthetic cohort.
+
+Each driver is run twice into the same output folder. The first run
+must finish and fill the smoothing cache; the second must reuse it.
+Needs FSL on PATH (the drivers call fslreorient2std/flirt/fnirt).
+
+Usage:
+    python smoke_smoothing.py [--keep /tmp/smoke_smoothing]
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import nibabel as nib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SUBJECTS = ("YC01", "YC02", "E01", "E02")
+
+
+def make_cohort(root, tracer_names, t1_name, shape=(32, 36, 30), seed=0):
+    """Write one T1 and two PETs per subject; AD-like subjects get more cortex uptake."""
+    rng = np.random.default_rng(seed)
+    grid = np.ogrid[tuple(slice(-1, 1, n * 1j) for n in shape)]
+    r = np.sqrt(sum(g ** 2 for g in grid))
+    brain, ctx, ref = r < 0.8, (r > 0.5) & (r < 0.75), r < 0.2
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    for i, subj in enumerate(SUBJECTS):
+        d = os.path.join(root, subj)
+        os.makedirs(d, exist_ok=True)
+        nib.save(nib.Nifti1Image(np.where(brain, 100.0, 0).astype(np.float32), affine),
+                 os.path.join(d, f"{subj}_{t1_name}.nii.gz"))
+        for k, tracer in enumerate(tracer_names):
+            load = (1.0 + 0.2 * i) if subj.startswith("E") else 1.0
+            pet = np.where(brain, 1.0, 0) + ctx * load * (1 + 0.3 * k) + ref * 0.1
+            pet = (pet + rng.normal(0, 0.02, shape) * brain).astype(np.float32)
+            nib.save(nib.Nifti1Image(pet, affine), os.path.join(d, f"{subj}_{tracer}.nii.gz"))
+    masks = {}
+    for name, sel in (("ctx", ctx), ("ref", ref)):
+        masks[name] = os.path.join(root, "..", f"{name}_mask.nii.gz")
+        nib.save(nib.Nifti1Image(sel.astype(np.uint8), affine), masks[name])
+    return masks
+
+
+def run_driver(name, argv, cache):
+    smooth = ["--native_fwhm", "4", "--target_fwhm", "8", "--smooth_cache", cache, "--n_boot", "50"]
+    for attempt in ("first", "second"):
+        res = subprocess.run([sys.executable, os.path.join(HERE, name)] + argv + smooth,
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            print(res.stdout[-2000:], res.stderr[-2000:])
+            raise SystemExit(f"❌ {name} failed on the {attempt} run")
+        cached = [f for f in os.listdir(cache) if f.endswith(".nii.gz")]
+        if not cached:
+            raise SystemExit(f"❌ {name}: smoothing cache {cache} is empty")
+        if attempt == "second" and "Skipping smoothing" not in res.stdout:
+            raise SystemExit(f"❌ {name}: second run did not reuse the smoothing cache")
+    print(f"✅ {name}: smoothing path ok ({len(cached)} cached images)")
+
+
+def main(args):
+    for tool in ("fslreorient2std", "flirt", "fnirt"):
+        if shutil.which(tool) is None:
+            raise SystemExit(f"{tool} is not on PATH; this smoke run needs FSL")
+    base = args.keep or tempfile.mkdtemp(prefix="smoke_smoothing_")
+    os.makedirs(base, exist_ok=True)
+
+    fbp = os.path.join(base, "florbetapir")
+    masks = make_cohort(os.path.join(fbp, "root"), ("FBP", "PiB"), "T1")
+    vois = os.path.join(fbp, "vois")
+    os.makedirs(vois, exist_ok=True)
+    shutil.copy(masks["ctx"], os.path.join(vois, "ctx.nii.gz"))
+    run_driver("florbetapir_calibration.py",
+               ["--root", os.path.join(fbp, "root"), "--outdir", os.path.join(fbp, "out"),
+                "--voi_targets", vois, "--voi_ref", masks["ref"]], os.path.join(fbp, "cache"))
+
+    fbb = os.path.join(base, "florbetaben")
+    masks = make_cohort(os.path.join(fbb, "root"), ("FBB", "PIB"), "MR")
+    run_driver("florbetaben_calibration.py",
+               ["--root", os.path.join(fbb, "root"), "--outdir", os.path.join(fbb, "out"),
+                "--voi_ctx", masks["ctx"], "--voi_wc", masks["ref"]], os.path.join(fbb, "cache"))
+
+    if not args.keep:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smoke run of PET smoothing through both drivers")
+    parser.add_argument("--keep", help="Work in this folder and keep it (default: temporary, removed)")
+    main(parser.parse_args())
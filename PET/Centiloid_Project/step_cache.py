@@ -0,0 +1,245 @@
+"""
+Content-addressed cache for FSL command-line steps.
+
+A step is keyed on:
+  - the full argv, with input and output paths replaced by placeholders,
+    so the same work under a different subject folder maps to one key;
+  - every input file, by SHA-256 of its content ('content' mode) or by
+    path, size and mtime ('stat' mode);
+  - the FSL version and the resolved path of the executable;
+  - the output file extensions and $FSLOUTPUTTYPE, so .nii and .nii.gz
+    runs of the same command are kept apart.
+
+Outputs are stored once under <cache_dir>/objects/<key>/ and hardlinked
+into the subject folders (copied when the cache is on another device).
+Cache hits therefore cost no disk space. Entries are evicted oldest-use
+first once the cache exceeds its size limit. Every hit and miss goes to
+events.log so a report can be printed for a run, including one that
+used a process pool.
+
+Files linked from the cache must not be modified in place. Write a new
+file and os.replace() it instead. Before a step is run, its existing
+outputs are removed, so a tool that truncates and rewrites its output
+path cannot change a cache entry linked there.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+RUN_ENV = "CENTILOID_CACHE_RUN"
+
+
+def fsl_version():
+    """FSL version string from $FSLDIR/etc/fslversion ('unknown' if missing)."""
+    path = os.path.join(os.environ.get("FSLDIR", "/usr/local/fsl"), "etc", "fslversion")
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return "unknown"
+
+
+def _split_token(tok):
+    """Split '--in=path' style tokens into ('--in=', 'path')."""
+    if tok.startswith("-") and "=" in tok:
+        flag, value = tok.split("=", 1)
+        return flag + "=", value
+    return "", tok
+
+
+def _nifti_ext(path):
+    name = os.path.basename(path)
+    return ".nii.gz" if name.endswith(".nii.gz") else os.path.splitext(name)[1]
+
+
+class StepCache:
+    def __init__(self, cache_dir, max_bytes=None, hash_mode="content", adopt_existing=False):
+        if hash_mode not in ("content", "stat"):
+            raise ValueError("hash_mode must be 'content' or 'stat'")
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.objects = os.path.join(self.cache_dir, "objects")
+        self.max_bytes = max_bytes
+        self.hash_mode = hash_mode
+        self.adopt_existing = adopt_existing
+        self._hashes = {}
+        self._version = fsl_version()
+        os.makedirs(self.objects, exist_ok=True)
+        os.environ.setdefault(RUN_ENV, uuid.uuid4().hex)
+
+    # ---------- keys ----------
+    def file_id(self, path):
+        st = os.stat(path)
+        if self.hash_mode == "stat":
+            return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+        memo = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        if memo not in self._hashes:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            self._hashes[memo] = h.hexdigest()
+        return self._hashes[memo]
+
+    def step_key(self, cmd, outputs):
+        """Return (key, input paths) for a command and its declared outputs."""
+        outputs = [os.path.abspath(o) for o in outputs]
+        argv, inputs = [], []
+        for tok in cmd:
+            flag, value = _split_token(tok)
+            path = os.path.abspath(value)
+            if path in outputs:
+                argv.append(f"{flag}{{out{outputs.index(path)}}}")
+            elif os.path.isfile(value) and path not in outputs:
+                argv.append(f"{flag}{{in{len(inputs)}}}")
+                inputs.append(value)
+            else:
+                argv.append(tok)
+        desc = {
+            "argv": argv,
+            "inputs": [self.file_id(p) for p in inputs],
+            "tool": [shutil.which(cmd[0]) or cmd[0], self._version],
+            "outputs": [_nifti_ext(o) for o in outputs],
+            "fsloutputtype": os.environ.get("FSLOUTPUTTYPE", ""),
+        }
+        key = hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+        return key, inputs
+
+    # ---------- storage ----------
+    @staticmethod
+    def _link(src, dst):
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def _store(self, key, outputs, runtime):
+        tmp = os.path.join(self.objects, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        names = []
+        for i, out in enumerate(outputs):
+            name = f"{i}_{os.path.basename(out)}"
+            self._link(out, os.path.join(tmp, name))
+            names.append(name)
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"outputs": names, "runtime": runtime, "created": time.time()}, f)
+        try:
+            os.rename(tmp, os.path.join(self.objects, key))
+        except OSError:
+            # Another worker stored the same step first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _log(self, event, key, cmd, runtime=0.0):
+        line = json.dumps({"run": os.environ[RUN_ENV], "event": event, "key": key[:12],
+                           "tool": cmd[0], "runtime": runtime, "time": time.time()})
+        with open(os.path.join(self.cache_dir, "events.log"), "a") as f:
+            f.write(line + "\n")
+
+    # ---------- public API ----------
+    def run(self, cmd, outputs, runner):
+        """Run ``cmd`` through ``runner`` unless its outputs are cached."""
+        outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+        key, _ = self.step_key(cmd, outputs)
+        entry = os.path.join(self.objects, key)
+        manifest = os.path.join(entry, "manifest.json")
+
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                info = json.load(f)
+            for name, out in zip(info["outputs"], outputs):
+                self._link(os.path.join(entry, name), out)
+            os.utime(manifest)  # mark as recently used
+            print(f"✅ Cache hit: {os.path.basename(outputs[0])} ({cmd[0]})")
+            self._log("hit", key, cmd, info.get("runtime", 0.0))
+            return
+
+        if self.adopt_existing and all(os.path.exists(o) for o in outputs):
+            print(f"✅ Adopting existing {os.path.basename(outputs[0])} into cache")
+            self._store(key, outputs, 0.0)
+            self._log("adopt", key, cmd)
+            return
+
+        # Unlink old outputs first: they may be hardlinks into a cache entry,
+        # and the tool could otherwise rewrite that entry's files in place
+        for out in outputs:
+            if os.path.lexists(out):
+                os.remove(out)
+        t0 = time.time()
+        runner(cmd)
+        runtime = time.time() - t0
+        missing = [o for o in outputs if not os.path.exists(o)]
+        if missing:
+            print(f"⚠️  Not caching {cmd[0]}: outputs missing {missing}")
+        else:
+            self._store(key, outputs, runtime)
+        self._log("miss", key, cmd, runtime)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes."""
+        if not self.max_bytes:
+            return 0
+        entries = []
+        for key in os.listdir(self.objects):
+            entry = os.path.join(self.objects, key)
+            manifest = os.path.join(entry, "manifest.json")
+            if key.startswith(".") or not os.path.exists(manifest):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, n)) for n in os.listdir(entry))
+            entries.append((os.path.getmtime(manifest), size, entry))
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        if removed:
+            print(f"🧹 Evicted {removed} cache entries ({total / 1024**3:.2f} GB kept)")
+        return removed
+
+    def report(self):
+        """Print hit/miss counts and time saved for the current run."""
+        log = os.path.join(self.cache_dir, "events.log")
+        if not os.path.exists(log):
+            return {}
+        counts = {"hit": 0, "miss": 0, "adopt": 0}
+        saved = spent = 0.0
+        with open(log) as f:
+            for line in f:
+                ev = json.loads(line)
+                if ev["run"] != os.environ[RUN_ENV]:
+                    continue
+                counts[ev["event"]] += 1
+                if ev["event"] == "hit":
+                    saved += ev["runtime"]
+                elif ev["event"] == "miss":
+                    spent += ev["runtime"]
+        print(f"\n📦 Step cache: {counts['hit']} hits, {counts['miss']} misses, "
+              f"{counts['adopt']} adopted; {saved / 60:.1f} min saved, {spent / 60:.1f} min run")
+        return counts
+
+
+def add_cache_args(parser):
+    """Command-line options shared by the calibration scripts."""
+    parser.add_argument("--cache-dir", help="Shared step cache directory (disabled if omitted)")
+    parser.add_argument("--cache-max-gb", type=float, help="Evict least recently used entries above this size")
+    parser.add_argument("--cache-hash", choices=["content", "stat"], default="content",
+                        help="Key inputs by content hash or by path/size/mtime")
+    parser.add_argument("--cache-adopt-existing", action="store_true",
+                        help="Trust outputs already on disk and add them to the cache")
+
+
+def cache_from_args(args):
+    """StepCache for parsed arguments, or None if caching is off."""
+    if not getattr(args, "cache_dir", None):
+        return None
+    max_bytes = int(args.cache_max_gb * 1024**3) if args.cache_max_gb else None
+    return StepCache(args.cache_dir, max_bytes, args.cache_hash, args.cache_adopt_existing)
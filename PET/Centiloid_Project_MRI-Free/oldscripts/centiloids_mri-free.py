@@ -6,6 +6,10 @@ import argparse
 import nibabel as nib
 import numpy as np
 import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from template_builder import build_template  # noqa: E402
 
 # FSL MNI template path (update if needed)
 MNI_TEMPLATE = "/usr/local/fsl/data/standard/MNI152_T1_1mm.nii.gz"
@@ -25,15 +29,8 @@ def nonlinear_register(in_file, ref_file, out_file):
     run(['fnirt', '--in=', in_file, '--ref=', ref_file, '--aff=', mat_file, '--iout=', out_file])
 
 def average_images(image_files, out_file):
-    """Average a list of images."""
-    tmp = image_files[0]
-    cmd = ['fslmaths', tmp, '-add', tmp, '-div', '2', out_file] if len(image_files) == 2 else None
-
-    if len(image_files) > 2:
-        # Start with first image
-        run(['fslmaths', image_files[0], '-add', image_files[1], '-div', '2', out_file])
-        for img in image_files[2:]:
-            run(['fslmaths', out_file, '-add', img, '-div', '2', out_file])
+    """Average a list of images (equal weights, streamed; see template_builder.py)."""
+    build_template(image_files, out_file)
 
 def extract_roi_values(nii_file, roi_file):
     """Extract mean intensity within ROI."""
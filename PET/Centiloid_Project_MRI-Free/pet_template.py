@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Iterative group-wise PET template for MRI-free spatial normalization.
+
+    iteration 0 : FLIRT every PET to the initial target (MNI T1), average
+    iteration k : register every PET to template k-1 and average again
+                  (FLIRT only for k = 1..--affine-iters, FLIRT + FNIRT after)
+
+Registrations of an iteration are run in a process pool. Averaging uses
+the streaming reducer in template_builder.py, so memory does not grow
+with the cohort. After every iteration the relative RMS change of the
+template and the mean correlation of the registered PETs with it are
+recorded. Iteration stops early once the change drops below --tol.
+
+Outputs in --outdir:
+    iter_<k>/...                       registered PETs and matrices/warps
+    template_<k>.nii.gz                template after iteration k
+    <tracer>_template.nii.gz (+ _sd)   final template
+    <tracer>_template.json             inputs, settings and metrics
+    template_metrics.csv               per-iteration timing and convergence
+
+Usage:
+    python pet_template.py --tracer PiB --images "/data/*/PiB_vol0.nii.gz" \
+        --outdir /data/PiB_template --iterations 6 --affine-iters 2 --jobs 8
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import datetime
+import subprocess
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pet_suvr"))
+from template_builder import build_template  # noqa: E402
+from nifti_stream import iter_slabs  # noqa: E402
+
+MNI_TEMPLATE = "/usr/local/fsl/data/standard/MNI152_T1_1mm.nii.gz"
+
+
+def run(cmd, log=None):
+    """Run an FSL command; output goes to ``log`` if given."""
+    if log is None:
+        subprocess.run(cmd, check=True)
+    else:
+        with open(log, "a") as f:
+            subprocess.run(cmd, check=True, stdout=f, stderr=subprocess.STDOUT)
+
+
+def register_one(pet, ref, out_prefix, nonlinear):
+    """Register one PET to ``ref``; returns the resampled image path.
+
+    Runs in a pool worker. Returns None if FSL fails, so one bad subject
+    does not stop the iteration.
+    """
+    mat = out_prefix + "_affine.mat"
+    flirt_out = out_prefix + "_flirt.nii.gz"
+    log = out_prefix + "_reg.log"
+    try:
+        run(['flirt', '-in', pet, '-ref', ref, '-out', flirt_out, '-omat', mat, '-dof', '12'], log)
+        if not nonlinear:
+            return flirt_out
+        fnirt_out = out_prefix + "_fnirt.nii.gz"
+        run(['fnirt', '--in=' + pet, '--ref=' + ref, '--aff=' + mat,
+             '--cout=' + out_prefix + "_warp.nii.gz", '--iout=' + fnirt_out], log)
+        return fnirt_out
+    except subprocess.CalledProcessError:
+        return None
+
+
+def subject_name(pet):
+    """Subject folder name, or the file name for flat input folders."""
+    parent = os.path.basename(os.path.dirname(os.path.abspath(pet)))
+    stem = os.path.basename(pet).replace(".nii.gz", "").replace(".nii", "")
+    return f"{parent}_{stem}"
+
+
+def template_change(new, old, slab=16):
+    """Relative RMS difference between two templates inside old > 0."""
+    num = den = 0.0
+    for (z0, z1, a), (_, _, b) in zip(iter_slabs(new, slab, np.float64), iter_slabs(old, slab, np.float64)):
+        m = b > 0
+        num += float(((a[m] - b[m]) ** 2).sum())
+        den += float((b[m] ** 2).sum())
+    return np.sqrt(num / den) if den > 0 else np.nan
+
+
+def correlation(path, template, slab=16):
+    """Pearson correlation of an image with the template (template > 0)."""
+    sx = sy = sxx = syy = sxy = 0.0
+    n = 0
+    for (_, _, x), (_, _, y) in zip(iter_slabs(path, slab, np.float64), iter_slabs(template, slab, np.float64)):
+        m = y > 0
+        x, y = x[m], y[m]
+        sx += x.sum(); sy += y.sum(); sxx += (x * x).sum(); syy += (y * y).sum(); sxy += (x * y).sum()
+        n += m.sum()
+    cov = sxy - sx * sy / n
+    return cov / np.sqrt((sxx - sx ** 2 / n) * (syy - sy ** 2 / n))
+
+
+def main(args):
+    os.makedirs(args.outdir, exist_ok=True)
+    pets = sorted(p for pat in args.images for p in glob.glob(pat))
+    if len(pets) < 2:
+        raise ValueError(f"Need at least 2 PETs, found {len(pets)}")
+    print(f"🧠 Building {args.tracer} template from {len(pets)} PETs")
+
+    ref = args.init
+    metrics = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for it in range(args.iterations):
+            nonlinear = it > args.affine_iters
+            it_dir = os.path.join(args.outdir, f"iter_{it}")
+            os.makedirs(it_dir, exist_ok=True)
+
+            t0 = time.time()
+            futures = [pool.submit(register_one, pet, ref, os.path.join(it_dir, subject_name(pet)), nonlinear)
+                       for pet in pets]
+            registered = [f.result() for f in futures]
+            failed = [p for p, r in zip(pets, registered) if r is None]
+            for p in failed:
+                print(f"⚠️  Registration failed for {p} in iteration {it}")
+            registered = [r for r in registered if r is not None]
+            t_reg = time.time() - t0
+
+            t0 = time.time()
+            template = os.path.join(args.outdir, f"template_{it}.nii.gz")
+            template_sd = os.path.join(args.outdir, f"template_{it}_sd.nii.gz")
+            kept, _ = build_template(registered, template, template_sd,
+                                     outlier_k=args.outlier_k, n_jobs=args.jobs)
+            t_avg = time.time() - t0
+
+            # The first template is compared with nothing (different modality target)
+            change = template_change(template, ref) if it > 0 else np.nan
+            mean_corr = float(np.mean([correlation(p, template) for p in kept]))
+            metrics.append({"iteration": it, "mode": "fnirt" if nonlinear else "flirt",
+                            "n_registered": len(registered), "n_kept": len(kept),
+                            "reg_s": round(t_reg, 1), "avg_s": round(t_avg, 1),
+                            "change": change, "mean_corr": mean_corr})
+            print(f"   iteration {it} ({metrics[-1]['mode']}): change {change:.4f}, "
+                  f"mean r {mean_corr:.4f}, registration {t_reg / 60:.1f} min, averaging {t_avg:.0f}s")
+
+            ref = template
+            if nonlinear and change < args.tol:
+                print(f"✅ Converged after iteration {it}")
+                break
+
+    final = os.path.join(args.outdir, f"{args.tracer}_template.nii.gz")
+    shutil.copyfile(ref, final)
+    shutil.copyfile(ref.replace(".nii.gz", "_sd.nii.gz"), final.replace(".nii.gz", "_sd.nii.gz"))
+
+    with open(os.path.join(args.outdir, "template_metrics.csv"), "w") as f:
+        f.write(",".join(metrics[0]) + "\n")
+        for m in metrics:
+            f.write(",".join(str(v) for v in m.values()) + "\n")
+    with open(final.replace(".nii.gz", ".json"), "w") as f:
+        json.dump({"tracer": args.tracer, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "init": args.init, "images": pets, "affine_iters": args.affine_iters,
+                   "outlier_k": args.outlier_k, "metrics": metrics}, f, indent=2)
+    print(f"✅ Saved {args.tracer} template to {final}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Iterative group-wise PET template")
+    parser.add_argument("--tracer", required=True, help="Tracer name used for output files (e.g. PiB)")
+    parser.add_argument("--images", nargs="+", required=True, help="3D PET images (globs allowed)")
+    parser.add_argument("--outdir", required=True, help="Output directory")
+    parser.add_argument("--init", default=MNI_TEMPLATE, help="Initial registration target")
+    parser.add_argument("--iterations", type=int, default=6, help="Maximum iterations (incl. the initial pass)")
+    parser.add_argument("--affine-iters", type=int, default=2, help="FLIRT-only iterations after the initial pass; FNIRT is added from iteration --affine-iters + 1")
+    parser.add_argument("--tol", type=float, default=0.005, help="Stop when the relative template change is below this")
+    parser.add_argument("--outlier-k", type=float, help="Exclude outlier PETs from averaging (see template_builder.py)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Parallel registrations")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Streaming group-mean / SD template builder.
+
+Images are split between worker threads. Each worker reads its images
+slab by slab (see pet_suvr/nifti_stream.py) and folds them into its own
+float64 running weighted mean and M2 (Welford). The partial results are
+then merged (Chan et al.) and the mean and SD images written once. At
+most one slab per worker plus the accumulators is in memory, whatever
+the number of subjects.
+
+Weighting: each image may carry a weight (e.g. scan quality). The SD
+uses reliability weights, which gives the usual n-1 SD for equal weights.
+
+Outlier exclusion (--outlier-k): after a first pass every image gets an
+RMS z-score against the group mean/SD inside the mask. Images more than
+k robust SDs (MAD) above the median score are dropped and the template
+is rebuilt from the rest.
+
+Usage:
+    python template_builder.py --images sub-*/PiB_FLIRT_to_MNI.nii.gz \
+        --out-mean PiB_template.nii.gz --out-sd PiB_template_sd.nii.gz \
+        --outlier-k 3 --jobs 8
+"""
+
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+import nibabel as nib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pet_suvr"))
+from nifti_stream import iter_slabs  # noqa: E402
+
+
+class Accumulator:
+    """Weighted running mean and M2 on a fixed grid (float64)."""
+
+    def __init__(self, shape):
+        self.w = 0.0
+        self.w2 = 0.0
+        self.n = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def add_slab(self, z0, z1, block, weight, w_new):
+        """Fold one slab of an image; ``w_new`` is the total weight after it."""
+        mean = self.mean[:, :, z0:z1]
+        delta = block - mean
+        mean += delta * (weight / w_new)
+        self.m2[:, :, z0:z1] += weight * delta * (block - mean)
+
+    def add_image(self, path, weight=1.0, slab=16):
+        w_new = self.w + weight
+        for z0, z1, block in iter_slabs(path, slab, dtype=np.float64):
+            self.add_slab(z0, z1, np.nan_to_num(block), weight, w_new)
+        self.w = w_new
+        self.w2 += weight ** 2
+        self.n += 1
+
+    def merge(self, other):
+        if other.w == 0:
+            return self
+        if self.w == 0:
+            return other
+        w = self.w + other.w
+        delta = other.mean - self.mean
+        self.mean += delta * (other.w / w)
+        self.m2 += other.m2 + delta ** 2 * (self.w * other.w / w)
+        self.w, self.w2, self.n = w, self.w2 + other.w2, self.n + other.n
+        return self
+
+    def sd(self):
+        denom = self.w - self.w2 / self.w if self.w > 0 else 0.0
+        if denom <= 0:
+            return np.zeros_like(self.mean)
+        return np.sqrt(np.maximum(self.m2, 0) / denom)
+
+
+def check_grid(paths):
+    """All images must share the first image's shape and affine."""
+    ref = nib.load(paths[0])
+    for p in paths[1:]:
+        img = nib.load(p)
+        if img.shape[:3] != ref.shape[:3] or not np.allclose(img.affine, ref.affine, atol=1e-3):
+            raise ValueError(f"{p} is not on the grid of {paths[0]}")
+    return ref
+
+
+def accumulate(paths, weights, shape, n_jobs=4, slab=16):
+    """Weighted mean/M2 of ``paths``, split across ``n_jobs`` threads."""
+    groups = [list(range(i, len(paths), n_jobs)) for i in range(min(n_jobs, len(paths)))]
+
+    def work(idx):
+        acc = Accumulator(shape)
+        for i in idx:
+            acc.add_image(paths[i], weights[i], slab)
+        return acc
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        parts = list(pool.map(work, groups))
+    total = parts[0]
+    for part in parts[1:]:
+        total = total.merge(part)
+    return total
+
+
+def outlier_scores(paths, mean, sd, mask, slab=16):
+    """RMS z-score of each image against the group inside ``mask``."""
+    ok = mask & (sd > 0)
+    scores = []
+    for path in paths:
+        ss, n = 0.0, 0
+        for z0, z1, block in iter_slabs(path, slab, dtype=np.float64):
+            m = ok[:, :, z0:z1]
+            z = (block[m] - mean[:, :, z0:z1][m]) / sd[:, :, z0:z1][m]
+            ss += float(np.nansum(z ** 2))
+            n += int(m.sum())
+        scores.append(np.sqrt(ss / max(n, 1)))
+    return np.array(scores)
+
+
+def build_template(paths, out_mean, out_sd=None, weights=None, outlier_k=None,
+                   mask=None, n_jobs=4, slab=16):
+    """Build and save the template. Returns (kept paths, outlier scores or None)."""
+    paths = list(paths)
+    if not paths:
+        raise ValueError("No images to average")
+    weights = np.ones(len(paths)) if weights is None else np.asarray(weights, dtype=float)
+    if len(weights) != len(paths):
+        raise ValueError(f"{len(weights)} weights for {len(paths)} images")
+    ref = check_grid(paths)
+    shape = ref.shape[:3]
+
+    acc = accumulate(paths, weights, shape, n_jobs, slab)
+    scores = None
+    if outlier_k is not None and len(paths) > 2:
+        mask = acc.mean != 0 if mask is None else mask
+        scores = outlier_scores(paths, acc.mean, acc.sd(), mask, slab)
+        med = np.median(scores)
+        mad = 1.4826 * np.median(np.abs(scores - med))
+        keep = scores <= med + outlier_k * mad if mad > 0 else np.ones(len(paths), bool)
+        if not keep.all():
+            for p, s in zip(np.array(paths)[~keep], scores[~keep]):
+                print(f"⚠️  Excluding outlier {p} (RMS z = {s:.2f}, median {med:.2f})")
+            paths = [p for p, k in zip(paths, keep) if k]
+            weights = weights[keep]
+            acc = accumulate(paths, weights, shape, n_jobs, slab)
+
+    for data, path in ((acc.mean, out_mean), (acc.sd() if out_sd else None, out_sd)):
+        if data is None:
+            continue
+        out = nib.Nifti1Image(data.astype(np.float32), ref.affine, ref.header)
+        out.set_data_dtype(np.float32)
+        out.header.set_slope_inter(1, 0)
+        nib.save(out, path)
+    print(f"✅ Template from {acc.n} images saved to {out_mean}")
+    return paths, scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming mean/SD template builder")
+    parser.add_argument("--images", nargs="+", required=True, help="Input images (globs allowed), all on one grid")
+    parser.add_argument("--out-mean", required=True, help="Output mean image")
+    parser.add_argument("--out-sd", help="Output SD image")
+    parser.add_argument("--weights", nargs="+", type=float, help="One weight per image (default: equal)")
+    parser.add_argument("--outlier-k", type=float, help="Exclude images with RMS z > median + k*MAD")
+    parser.add_argument("--mask", help="Mask for outlier scores (default: non-zero mean)")
+    parser.add_argument("--jobs", type=int, default=4, help="Worker threads")
+    parser.add_argument("--slab", type=int, default=16, help="z-slices read at a time")
+    args = parser.parse_args()
+
+    images = [p for pat in args.images for p in (sorted(glob.glob(pat)) or [pat])]
+    mask = np.asarray(nib.load(args.mask).dataobj) > 0 if args.mask else None
+    build_template(images, args.out_mean, args.out_sd, args.weights, args.outlier_k,
+                   mask, args.jobs, args.slab)
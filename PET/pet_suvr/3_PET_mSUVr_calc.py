@@ -1,6 +1,7 @@
 import os
 import os.path as op
 import glob
+import json
 import numpy as np
 import pandas as pd
 import nibabel as nib
@@ -8,6 +9,10 @@ from joblib import Parallel, delayed
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import seaborn as sns
+from roi_stats import DEFAULT_STATS, combine_masks, label_stats, per_mask_stats
+from pvc import gtm_pvc
+from composites import load_composites, resolve_regions, region_value, composite_suvr
+from suvr_image import write_suvr_image
 
 
 def vectorize(img, mask):
@@ -37,8 +42,68 @@ def vectorize(img, mask):
     return np.squeeze(s)
 
 
-def roimean(subDir):
-    """Compute mean PET values inside ROI masks."""
+CACHE_NAME = 'roi_means_cache.json'
+
+
+def file_signature(path):
+    """Return (size, mtime) for a file, used to detect changed inputs."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def cache_key(imgPath, roiList, stats, pvcFwhm=None):
+    """Build the cache key for one subject from the PET, ROI set and stats."""
+    key = {
+        'pet': file_signature(imgPath),
+        'roi': {op.basename(j): file_signature(j) for j in roiList},
+        'stats': list(stats),
+    }
+    if pvcFwhm:
+        key['pvc_fwhm'] = pvcFwhm
+    return key
+
+
+def load_cached_stats(subDir, key):
+    """Return cached ROI statistics for a subject, or None if stale/missing."""
+    cachePath = op.join(subDir, CACHE_NAME)
+    if not op.exists(cachePath):
+        return None
+    try:
+        with open(cachePath, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('key') != key:
+        return None
+    return {k: np.array([np.nan if v is None else v for v in vals])
+            for k, vals in cached['stats'].items()}
+
+
+def save_cached_stats(subDir, key, subStats):
+    """Write ROI statistics for a subject next to its PET image."""
+    cachePath = op.join(subDir, CACHE_NAME)
+    tmpPath = cachePath + '.tmp'
+    stats = {k: [None if np.isnan(v) else float(v) for v in vals]
+             for k, vals in subStats.items()}
+    with open(tmpPath, 'w') as f:
+        json.dump({'key': key, 'stats': stats}, f)
+    os.replace(tmpPath, cachePath)
+
+
+def roimean(subDir, useCache=True, stats=DEFAULT_STATS, suvrRef=None, pvcFwhm=None):
+    """Compute PET statistics inside ROI masks.
+
+    All ROI masks are combined into one label image and every statistic in
+    ``stats`` is computed for every ROI in a single pass (see roi_stats.py).
+    Results are cached per subject in ``roi_means_cache.json`` and reused
+    as long as the PET image, ROI masks and statistics are unchanged.
+
+    If ``suvrRef`` (a composite from composites.json) is given, a voxelwise
+    SUVR.nii.gz is also written using that composite's reference mean.
+    If ``pvcFwhm`` (PET resolution in mm) is given, GTM partial-volume
+    corrected means are added as ``pvc_mean`` (see pvc.py).
+    """
+    stats = tuple(dict.fromkeys(('mean', 'sum', 'count') + tuple(stats)))
     imgPath = op.join(subDir, 'SUV_REG_reslice.nii.gz')
     subProc = op.basename(subDir)
 
@@ -52,46 +117,151 @@ def roimean(subDir):
         tqdm.write(f"Skipping {subProc}: no ROI masks found in {roiDir}")
         return None
 
+    key = cache_key(imgPath, roiList, stats, pvcFwhm)
+    subStats = load_cached_stats(subDir, key) if useCache else None
+    if subStats is not None:
+        tqdm.write(f"Using cached ROI stats for {subProc}")
+    else:
+        try:
+            img_obj = nib.load(imgPath)
+            img = np.array(img_obj.dataobj)
+        except Exception as e:
+            tqdm.write(f"Skipping {subProc}: error loading PET ({e})")
+            return None
+
+        tqdm.write(f"Processing {subProc}")
+        zooms = img_obj.header.get_zooms()[:3]
+        # Each mask is read once; overlapping masks are kept for the per-mask fallback
+        labels, separate = combine_masks(roiList)
+        overlap = separate is not None
+        if overlap:
+            subStats = per_mask_stats(img, separate, stats, zooms)
+        else:
+            subStats = label_stats(img, labels, np.arange(1, len(roiList) + 1), stats, zooms)
+        if pvcFwhm:
+            if overlap:
+                tqdm.write(f"No PVC for {subProc}: ROI masks overlap")
+                subStats['pvc_mean'] = np.full(len(roiList), np.nan)
+            else:
+                subStats['pvc_mean'] = gtm_pvc(subStats['mean'], labels, np.arange(1, len(roiList) + 1),
+                                               pvcFwhm, zooms)
+        save_cached_stats(subDir, key, subStats)
+
+    if suvrRef is not None:
+        roiNames = [op.basename(j).split('.nii.gz')[0] for j in roiList]
+        subject_suvr_image(subDir, imgPath, roiNames, subStats, suvrRef)
+
+    return subStats, subProc
+
+
+def subject_suvr_image(subDir, imgPath, roiNames, subStats, suvrRef):
+    """Write SUVR.nii.gz for one subject unless an up-to-date one exists.
+
+    The image is current if SUVR.json (written alongside it) records the
+    same ROI statistics cache, PET and reference-region definition, so
+    editing the reference in composites.json rewrites it.
+    """
+    suvrPath = op.join(subDir, 'SUVR.nii.gz')
+    keyPath = op.join(subDir, 'SUVR.json')
+    regions = resolve_regions(suvrRef['reference'], roiNames)
+    weighting = suvrRef.get('weighting', 'region')
+    key = {
+        'stats': file_signature(op.join(subDir, CACHE_NAME)),
+        'pet': file_signature(imgPath),
+        'reference': regions,
+        'weighting': weighting,
+    }
+    if op.exists(suvrPath) and op.exists(keyPath):
+        try:
+            with open(keyPath, 'r') as f:
+                if json.load(f) == key:
+                    return suvrPath
+        except (OSError, ValueError):
+            pass
+
+    sums = pd.DataFrame([subStats['sum']], columns=roiNames)
+    counts = pd.DataFrame([subStats['count']], columns=roiNames)
+    refMean = region_value(sums, counts, regions, weighting).iloc[0]
     try:
-        img_obj = nib.load(imgPath)
-        img = np.array(img_obj.dataobj)
-    except Exception as e:
-        tqdm.write(f"Skipping {subProc}: error loading PET ({e})")
+        write_suvr_image(imgPath, refMean, suvrPath)
+    except ValueError as e:
+        tqdm.write(f"No SUVR image for {op.basename(subDir)}: {e}")
         return None
+    with open(keyPath + '.tmp', 'w') as f:
+        json.dump(key, f)
+    os.replace(keyPath + '.tmp', keyPath)
+    return suvrPath
 
-    subMean = []
-    tqdm.write(f"Processing {subProc}")
-    for j in roiList:
-        roi_name = op.basename(j).split('.nii.gz')[0]
-        tqdm.write(f"...computing {roi_name}")
-        roi = np.array(nib.load(j).dataobj, dtype=int)
-        if roi.sum() == 0:
-            subMean.append(np.nan)
-        else:
-            subMean.append(np.nanmean(vectorize(img, roi)))
 
-    return subMean, subProc
+SEX_DTYPE = pd.CategoricalDtype(['F', 'M'])
+
+
+def append_parquet(table, dsDir):
+    """Append rows for new subjects to a Parquet dataset directory.
+
+    Each run only writes a new ``part-NNNN.parquet`` holding subjects not
+    already in the dataset. If a stored subject changed or disappeared the
+    dataset is compacted into a single part instead.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print(f"[WARN] pyarrow not installed, skipping {op.basename(dsDir)}")
+        return
+
+    table = table.rename_axis('studyid')
+    os.makedirs(dsDir, exist_ok=True)
+    parts = sorted(glob.glob(op.join(dsDir, 'part-*.parquet')))
+    if parts:
+        old = pd.concat([pd.read_parquet(x) for x in parts])
+        keep = old.index.isin(table.index)
+        unchanged = (keep.all()
+                     and list(old.columns) == list(table.columns)
+                     and old.equals(table.loc[old.index]))
+        if not unchanged:
+            for x in parts:
+                os.remove(x)
+            parts = []
+        else:
+            table = table.loc[~table.index.isin(old.index)]
+    if len(table) == 0:
+        print(f"[INFO] {op.basename(dsDir)} is up to date")
+        return
+    outPath = op.join(dsDir, f"part-{len(parts):04d}.parquet")
+    table.to_parquet(outPath)
+    print(f"[INFO] Wrote {len(table)} subjects to {outPath}")
 
 
 # --- Paths ---
 mainDir = '/Volumes/vdrive/helpern_users/helpern_j/IAM/IAM_Imaging/MRI/IAM_BIDS/derivatives/PET/pet_suv'
 redCap_FS = '/Volumes/vdrive/helpern_users/helpern_j/IAM/IAM_Imaging/MRI/IAM_Summary_Files/PET/pet_suv/IAMDatabaseY0-FreeSurferNormalizat_DATA_2026-02-10_1401.csv'
 outDir = mainDir
+useCache = True  # set False to force recomputation of every subject
+roiStats = DEFAULT_STATS  # per-ROI statistics written to ROI_Stats.csv for QC
+compositeFile = op.join(op.dirname(op.abspath(__file__)), 'composites.json')
+writeSuvrImages = True  # voxelwise SUVR.nii.gz per subject (mSUVr reference)
+pvcFwhm = None  # PET resolution in mm (e.g. 6.0) to add GTM partial-volume corrected SUVRs
 
 subjects = sorted(glob.glob(op.join(mainDir, 'sub-*')))
 subID = [op.basename(x) for x in subjects]
 
-# --- Parallel ROI means ---
+composites = load_composites(compositeFile)
+if 'mSUVr' not in composites:
+    raise ValueError(f"{compositeFile} must define an 'mSUVr' composite")
+suvrRef = composites['mSUVr'] if writeSuvrImages else None
+
+# --- Parallel ROI means (and SUVR images) ---
 inputs = range(len(subjects))
 results = Parallel(n_jobs=16, prefer='processes')(
-    delayed(roimean)(subjects[i]) for i in tqdm(inputs, desc='Computing Means')
+    delayed(roimean)(subjects[i], useCache, roiStats, suvrRef, pvcFwhm) for i in tqdm(inputs, desc='Computing Means')
 )
 results = [r for r in results if r is not None]  # drop failed cases
 
 if len(results) == 0:
     raise RuntimeError("No subjects were processed successfully!")
 
-data, subs = zip(*results)
+subStats, subs = zip(*results)
+data = [st['mean'] for st in subStats]
 
 # --- Build dataframe ---
 roiDir = op.join(subjects[0], 'roi')
@@ -102,18 +272,17 @@ df = pd.DataFrame(data, columns=roiID, index=subs)
 df.dropna(how='all', inplace=True)
 
 df_ = pd.read_csv(redCap_FS, index_col=0)
-age, sex, mta, amyloid = [], [], [], []
-
-for index in df.index:
-    age.append(df_.loc[index]['age'])
-    amyloid.append(df_.loc[index]['pet_amyloid'])
-    sex.append('M' if df_.loc[index]['sex'] == 1 else 'F')
-    mta.append(np.mean([df_.loc[index]['mta_l'], df_.loc[index]['mta_r']]))
-
-df.insert(0, 'sex', sex)
-df.insert(1, 'age', age)
-df.insert(2, 'amyloid', amyloid)
-df.insert(3, 'mta', mta)
+df_ = df_[~df_.index.duplicated(keep='first')]
+
+# Vectorized join against the REDCap export (subjects missing there get <NA>)
+demo = pd.DataFrame({
+    'sex': np.where(df_['sex'] == 1, 'M', 'F'),
+    'age': df_['age'].astype(float),
+    'amyloid': df_['pet_amyloid'],
+    'mta': df_[['mta_l', 'mta_r']].mean(axis=1, skipna=False),
+}, index=df_.index)
+df = demo.reindex(df.index).join(df)
+df['sex'] = df['sex'].astype(SEX_DTYPE)
 # Convert amyloid column to nullable integer (keeps missing values as <NA>)
 df['amyloid'] = df['amyloid'].astype('Int64')
 
@@ -122,18 +291,39 @@ missing_count = df['amyloid'].isna().sum()
 print(f"\n[INFO] Amyloid column converted to Int64. Missing values: {missing_count}\n")
 
 # --- Compute SUVr ---
-cerebellum_mean = np.nanmean(df.loc[:, 'Left-Cerebellum-Cortex':'Right-Cerebellum-Cortex'], axis=1)
-df.loc[:, 'ctx-lh-caudalanteriorcingulate':'ctx-rh-superiorparietal'] = \
-    df.loc[:, 'ctx-lh-caudalanteriorcingulate':'ctx-rh-superiorparietal'].div(cerebellum_mean, axis=0)
-df['mSUVr'] = df.loc[:, 'ctx-lh-caudalanteriorcingulate':'ctx-rh-superiorparietal'].mean(axis=1)
+# Composites come from per-label sums and counts; 'mSUVr' is the primary one
+# and its target regions are also reported as regional SUVRs.
+sums = pd.DataFrame([st['sum'] for st in subStats], columns=roiID, index=subs).loc[df.index]
+counts = pd.DataFrame([st['count'] for st in subStats], columns=roiID, index=subs).loc[df.index]
+for name, comp in composites.items():
+    df[name], ref_mean = composite_suvr(sums, counts, comp, name)
+    if name == 'mSUVr':
+        targets = resolve_regions(comp['target'], roiID)
+        df[targets] = df[targets].div(ref_mean, axis=0)
+
+# Partial-volume corrected composites use the corrected regional means
+if pvcFwhm:
+    pvc = pd.DataFrame([st['pvc_mean'] for st in subStats], columns=roiID, index=subs).loc[df.index]
+    pvc.rename_axis('studyid').to_csv(op.join(outDir, 'PVC_SUV_Values.csv'))
+    for name, comp in composites.items():
+        df[f"{name}_PVC"], _ = composite_suvr(pvc * counts, counts, comp, name)
 
 # --- Save outputs ---
 df.to_csv(op.join(outDir, 'mSUVR_Values.csv'))
 rc = pd.DataFrame(data, columns=roiID, index=subs)
 rc.dropna(how='all', inplace=True)
-rc['mSUVr'] = df['mSUVr']
+rc[list(composites)] = df[list(composites)]
 rc.index.name = 'studyid'
 rc.to_csv(op.join(outDir, 'Raw_SUV_Values.csv'))
+append_parquet(df, op.join(outDir, 'mSUVR_Values.parquet'))
+
+# Long-format QC table: one row per subject and ROI, one column per statistic
+qc = pd.concat(
+    [pd.DataFrame(st, index=pd.Index(roiID, name='roi')).assign(studyid=sub)
+     for st, sub in zip(subStats, subs)]
+).reset_index().set_index(['studyid', 'roi'])
+qc.to_csv(op.join(outDir, 'ROI_Stats.csv'))
+append_parquet(rc, op.join(outDir, 'Raw_SUV_Values.parquet'))
 
 # --- Plot ---
 sns.set_context('talk')
@@ -0,0 +1,70 @@
+"""
+Composite SUVRs evaluated from per-label sums and voxel counts.
+
+Composites are defined in a JSON file (see composites.json):
+
+    {"name": {"target": [...], "reference": [...], "weighting": "region"}}
+
+Target and reference entries are ROI names or fnmatch patterns such as
+``"ctx-*-precuneus"``. With ``"weighting": "voxel"`` each set is the mean
+over all of its voxels; with ``"region"`` it is the mean of the regional
+means. Only the per-label sums and counts are needed, so any number of
+composites can be compared without touching the images again.
+"""
+
+import json
+import fnmatch
+import numpy as np
+import pandas as pd
+
+WEIGHTINGS = ('voxel', 'region')
+
+
+def load_composites(path):
+    """Read and validate composite definitions from a JSON file."""
+    with open(path, 'r') as f:
+        comps = json.load(f)
+    for name, comp in comps.items():
+        if not comp.get('target') or not comp.get('reference'):
+            raise ValueError(f"Composite '{name}' needs 'target' and 'reference' regions")
+        if comp.get('weighting', 'region') not in WEIGHTINGS:
+            raise ValueError(f"Composite '{name}': weighting must be one of {WEIGHTINGS}")
+    return comps
+
+
+def resolve_regions(patterns, rois):
+    """Expand names/fnmatch patterns against the available ROI names.
+
+    Entries that match no ROI are ignored, so one definition works for ROI
+    sets that only contain part of the atlas.
+    """
+    out = []
+    for pattern in patterns:
+        out.extend(r for r in rois if fnmatch.fnmatchcase(r, pattern) and r not in out)
+    return out
+
+
+def region_value(sums, counts, regions, weighting='region'):
+    """Mean uptake of a set of regions for every subject (row)."""
+    if not regions:
+        return pd.Series(np.nan, index=sums.index)
+    if weighting == 'voxel':
+        n = counts[regions].sum(axis=1)
+        return sums[regions].sum(axis=1) / n.where(n > 0)
+    c = counts[regions]
+    return (sums[regions] / c.where(c > 0)).mean(axis=1)
+
+
+def composite_suvr(sums, counts, comp, name='composite'):
+    """SUVR of one composite from (subjects x ROIs) sum and count tables.
+
+    Returns ``(suvr, ref)`` where ``ref`` is the reference-region mean.
+    """
+    rois = list(sums.columns)
+    weighting = comp.get('weighting', 'region')
+    target = resolve_regions(comp['target'], rois)
+    reference = resolve_regions(comp['reference'], rois)
+    if not target or not reference:
+        print(f"[WARN] Composite '{name}' has no matching target or reference ROIs")
+    ref = region_value(sums, counts, reference, weighting)
+    return region_value(sums, counts, target, weighting) / ref, ref
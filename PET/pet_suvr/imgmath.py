@@ -0,0 +1,144 @@
+"""
+In-process image arithmetic, a replacement for chains of fslmaths calls.
+
+    imgmath("bin(a + b) * c", "out.nii.gz", a="a.nii.gz", b="b.nii.gz", c="c.nii.gz")
+    imgmath("mas(thr(pet, 0), brain)", "pet_thr.nii.gz", pet=pet_path, brain=mask_path)
+    suvr = imgmath("pet / ref", pet=pet_path, ref=1.23)      # no out: returns the array
+
+The expression is ordinary Python syntax over the named operands (image
+paths, nibabel images or scalars): + - * / ** and unary -, comparisons,
+& | ~, and the functions in FUNCS. It is parsed and checked once, then
+evaluated on one z-slab of every image at a time (see nifti_stream.py),
+so memory stays flat and each input is decoded once. The result is
+written once, to a temporary file that replaces ``out`` at the end.
+
+All images must share the grid (shape and affine) of the first one.
+
+fslmaths equivalents:
+    -add/-sub/-mul/-div     a + b, a - b, a * b, a / b
+    -bin                    bin(a)
+    -thr t / -uthr t        thr(a, t) / uthr(a, t)
+    -mas m                  mas(a, m)
+    -max b / -min b         max(a, b) / min(a, b)
+"""
+
+import os
+import ast
+from contextlib import ExitStack
+import numpy as np
+import nibabel as nib
+from nifti_stream import iter_slabs, SlabWriter
+
+
+def _div(a, b):
+    # fslmaths -div gives 0 where the divisor is 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.true_divide(a, b)
+    return np.where(np.asarray(b) == 0, 0, out)
+
+
+FUNCS = {
+    "bin": lambda a: (a != 0).astype(np.uint8),
+    "thr": lambda a, t: np.where(a >= t, a, 0),
+    "uthr": lambda a, t: np.where(a <= t, a, 0),
+    "mas": lambda a, m: np.where(m > 0, a, 0),
+    "max": np.maximum,
+    "min": np.minimum,
+    "where": np.where,
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "nan": np.nan_to_num,
+}
+
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+          ast.Constant, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+          ast.BitAnd, ast.BitOr, ast.Invert, ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq)
+
+
+class _DivToCall(ast.NodeTransformer):
+    """Route ``/`` through _div so division by zero gives 0 as in fslmaths."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Div):
+            return ast.copy_location(ast.Call(ast.Name("_div", ast.Load()), [node.left, node.right], []), node)
+        return node
+
+
+def compile_expr(expr, names):
+    """Parse and check ``expr``; only operands in ``names`` and FUNCS are allowed."""
+    tree = ast.parse(expr, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES):
+            raise ValueError(f"Unsupported syntax in {expr!r}: {type(node).__name__}")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCS):
+            raise ValueError(f"Unknown function in {expr!r}: {ast.unparse(node.func)}")
+        if isinstance(node, ast.Name) and node.id not in names and node.id not in FUNCS:
+            raise ValueError(f"Undefined operand {node.id!r} in {expr!r}")
+    tree = ast.fix_missing_locations(_DivToCall().visit(tree))
+    return compile(tree, "<imgmath>", "eval")
+
+
+def _load(name, value):
+    img = nib.load(value) if isinstance(value, (str, os.PathLike)) else value
+    if int(np.prod(img.shape[3:])) != 1:
+        raise ValueError(f"imgmath operand {name!r} is not a 3D image (shape {img.shape})")
+    return img
+
+
+def imgmath(expr, out=None, slab=16, dtype=None, **operands):
+    """Evaluate ``expr`` slab by slab; write to ``out`` or return the array.
+
+    ``dtype`` defaults to uint8 for boolean/uint8 results and float32
+    otherwise.
+    """
+    scalars = {k: v for k, v in operands.items() if isinstance(v, (int, float, np.number))}
+    images = {k: _load(k, v) for k, v in operands.items() if k not in scalars}
+    if not images:
+        raise ValueError("imgmath needs at least one image operand")
+    code = compile_expr(expr, set(operands))
+
+    ref_name, ref = next(iter(images.items()))
+    shape = ref.shape[:3]
+    for name, img in images.items():
+        if img.shape[:3] != shape or not np.allclose(img.affine, ref.affine, atol=1e-4):
+            raise ValueError(f"imgmath operand {name!r} is not on the grid of {ref_name!r}")
+
+    namespace = dict(FUNCS, _div=_div, **scalars)
+    readers = {k: iter_slabs(img, slab) for k, img in images.items()}
+    result = None
+    tmp = None
+    if out is not None:
+        # Only the file name gets the .tmp marker; directories may contain ".nii"
+        head, name = os.path.split(out)
+        tmp = os.path.join(head, name.replace(".nii", ".tmp.nii", 1))
+
+    try:
+        with ExitStack() as stack:
+            writer = None
+            for z0 in range(0, shape[2], slab):
+                z1 = min(z0 + slab, shape[2])
+                for k, reader in readers.items():
+                    namespace[k] = next(reader)[2].reshape(shape[:2] + (z1 - z0,))
+                block = np.broadcast_to(eval(code, {"__builtins__": {}}, namespace), shape[:2] + (z1 - z0,))
+                if writer is None and result is None:
+                    out_dtype = dtype or (np.uint8 if block.dtype in (np.bool_, np.uint8) else np.float32)
+                    if out is None:
+                        result = np.empty(shape, dtype=out_dtype)
+                    else:
+                        writer = stack.enter_context(SlabWriter(tmp, ref.affine, ref.header, shape, out_dtype))
+                if writer is None:
+                    result[:, :, z0:z1] = block
+                else:
+                    writer.write(block)
+    except BaseException:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if out is None:
+        return result
+    os.replace(tmp, out)
+    return out
@@ -0,0 +1,94 @@
+"""
+Region-based partial-volume correction (geometric transfer matrix, GTM).
+
+For every label, its indicator image is blurred with the PET point-spread
+function. A separable Gaussian is applied only inside the label's bounding
+box, padded by 4 sigma. The blurred indicator is then averaged over every
+label it reaches, which gives one column of the GTM:
+
+    G[j, i] = mean over region j of (PSF * indicator_i)
+
+G is stored as a sparse matrix. The corrected regional means x solve
+G x = t, where t are the observed regional means.
+
+Voxels outside all labels are treated as zero activity. Add a label for
+the remaining tissue/CSF if spill-in from it matters.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.ndimage import gaussian_filter, find_objects
+from scipy.sparse.linalg import spsolve
+
+FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+
+def _sigma_vox(fwhm, zooms):
+    fwhm = np.broadcast_to(np.asarray(fwhm, dtype=float), (3,))
+    return fwhm * FWHM_TO_SIGMA / np.asarray(zooms[:3], dtype=float)
+
+
+def gtm_matrix(labels, label_ids, fwhm, zooms, truncate=4.0):
+    """Build the sparse GTM (len(label_ids) x len(label_ids)).
+
+    Returns ``(G, counts)`` where ``counts`` are the voxels per label.
+    """
+    labels = np.asarray(labels)
+    label_ids = np.asarray(label_ids)
+    sigma = _sigma_vox(fwhm, zooms)
+    pad = np.ceil(truncate * sigma).astype(int)
+
+    # Map label values to row indices (-1 = not a requested label)
+    lut = np.full(max(int(labels.max()), int(label_ids.max())) + 1, -1, dtype=np.int64)
+    lut[label_ids] = np.arange(len(label_ids))
+    rows_all = lut[labels]
+    counts = np.bincount(rows_all[rows_all >= 0], minlength=len(label_ids)).astype(float)
+    boxes = find_objects(rows_all + 1, max_label=len(label_ids))
+
+    rows, cols, vals = [], [], []
+    for i, lab in enumerate(label_ids):
+        if boxes[i] is None:
+            continue
+        box = tuple(slice(max(sl.start - m, 0), min(sl.stop + m, n))
+                    for sl, m, n in zip(boxes[i], pad, labels.shape))
+
+        ind = (labels[box] == lab).astype(np.float32)
+        spread = gaussian_filter(ind, sigma, mode='constant', truncate=truncate)
+        r = rows_all[box].ravel()
+        keep = r >= 0
+        col = np.bincount(r[keep], weights=spread.ravel()[keep], minlength=len(label_ids))
+        nz = np.nonzero(col)[0]
+        rows.extend(nz)
+        cols.extend([i] * len(nz))
+        vals.extend(col[nz] / counts[nz])
+
+    G = sparse.csc_matrix((vals, (rows, cols)), shape=(len(label_ids), len(label_ids)))
+    return G, counts
+
+
+def gtm_pvc(observed, labels, label_ids, fwhm, zooms):
+    """Partial-volume corrected regional means.
+
+    Parameters
+    ----------
+    observed : array
+        Observed mean PET value per label (aligned with ``label_ids``).
+    labels : ndarray of int
+        Label image on the PET grid.
+    label_ids : sequence of int
+        Labels to correct.
+    fwhm : float or 3 floats
+        PET resolution (mm), isotropic or per axis.
+    zooms : sequence of float
+        Voxel size in mm.
+
+    Returns an array aligned with ``label_ids``; empty labels get NaN.
+    """
+    G, counts = gtm_matrix(labels, label_ids, fwhm, zooms)
+    observed = np.asarray(observed, dtype=float)
+    valid = (counts > 0) & np.isfinite(observed)
+    out = np.full(len(label_ids), np.nan)
+    if valid.any():
+        Gv = G[valid][:, valid]
+        out[valid] = np.atleast_1d(spsolve(Gv.tocsc(), observed[valid]))
+    return out
@@ -0,0 +1,173 @@
+"""
+Regional PET statistics computed for every label in a single pass.
+
+PET voxels are sorted once by (label, value). Every statistic for every
+label is then read from that sorted order, so adding medians or
+percentiles costs nothing extra in image I/O. When only means, sums,
+counts or volumes are asked for, np.bincount is used and the sort skipped.
+
+Used by 3_PET_mSUVr_calc.py and the Centiloid_Project scripts.
+"""
+
+import numpy as np
+import nibabel as nib
+
+# Statistics understood by label_stats(). 'pNN' gives the NNth percentile.
+DEFAULT_STATS = ('mean', 'median', 'sd', 'p5', 'p95', 'count', 'volume')
+
+
+def _percentile(vals, starts, counts, q):
+    """Linear-interpolated percentile of each sorted run (as np.percentile)."""
+    pos = (counts - 1) * (q / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, counts - 1)
+    frac = pos - lo
+    return vals[starts + lo] * (1 - frac) + vals[starts + hi] * frac
+
+
+def label_stats(img, labels, label_ids=None, stats=DEFAULT_STATS, zooms=None):
+    """Compute statistics of ``img`` inside every label of ``labels``.
+
+    Parameters
+    ----------
+    img : ndarray
+        PET image. NaN voxels are ignored (as np.nanmean does).
+    labels : ndarray of int
+        Label image on the same grid; 0 is background.
+    label_ids : sequence of int, optional
+        Labels to report, in output order. Defaults to all non-zero labels.
+    stats : sequence of str
+        Any of 'mean', 'median', 'sd', 'sum', 'min', 'max', 'count',
+        'volume' (mm^3, needs ``zooms``) and 'pNN' percentiles.
+    zooms : sequence of float, optional
+        Voxel size used for 'volume'.
+
+    Returns
+    -------
+    dict
+        ``{stat: ndarray}`` aligned with ``label_ids``. Labels without
+        voxels get NaN (count 0).
+    """
+    if img.shape[:3] != labels.shape[:3]:
+        raise ValueError(f"Image shape {img.shape} does not match labels {labels.shape}")
+
+    lab = np.asarray(labels).ravel()
+    vals = np.asarray(img, dtype=np.float64).ravel()
+    keep = (lab != 0) & np.isfinite(vals)
+    lab = lab[keep].astype(np.int64)
+    vals = vals[keep]
+
+    if all(s in ('mean', 'sum', 'count', 'volume') for s in stats):
+        # No order statistics requested: bincount is enough, skip the sort
+        n = np.bincount(lab)
+        present = np.nonzero(n)[0]
+        counts = n[present]
+        starts = None
+        sums = np.bincount(lab, weights=vals)[present]
+    else:
+        order = np.lexsort((vals, lab))
+        lab = lab[order]
+        vals = vals[order]
+        present, starts, counts = np.unique(lab, return_index=True, return_counts=True)
+        sums = np.add.reduceat(vals, starts) if len(present) else np.zeros(0)
+
+    if label_ids is None:
+        label_ids = present
+    label_ids = np.asarray(label_ids, dtype=np.int64)
+    # Position of each requested label among the labels actually present
+    found = np.zeros(len(label_ids), dtype=bool)
+    idx = np.zeros(len(label_ids), dtype=np.int64)
+    if len(present):
+        idx = np.clip(np.searchsorted(present, label_ids), 0, len(present) - 1)
+        found = present[idx] == label_ids
+    means = sums / np.maximum(counts, 1)
+
+    out = {}
+    for stat in stats:
+        if stat == 'count':
+            res = counts
+        elif stat == 'volume':
+            if zooms is None:
+                raise ValueError("'volume' needs voxel zooms")
+            res = counts * float(np.prod(zooms[:3]))
+        elif stat == 'sum':
+            res = sums
+        elif stat == 'mean':
+            res = means
+        elif stat == 'sd':
+            dev = (vals - np.repeat(means, counts)) ** 2
+            res = np.sqrt(np.add.reduceat(dev, starts) / counts) if len(present) else means
+        elif stat == 'min':
+            res = vals[starts]
+        elif stat == 'max':
+            res = vals[starts + counts - 1]
+        elif stat == 'median':
+            res = _percentile(vals, starts, counts, 50)
+        elif stat.startswith('p') and stat[1:].replace('.', '', 1).isdigit():
+            res = _percentile(vals, starts, counts, float(stat[1:]))
+        else:
+            raise ValueError(f"Unknown statistic '{stat}'")
+
+        if stat in ('count', 'volume', 'sum'):
+            full = np.zeros(len(label_ids), dtype=np.float64)
+        else:
+            full = np.full(len(label_ids), np.nan)
+        full[found] = np.asarray(res, dtype=np.float64)[idx[found]]
+        out[stat] = full
+    return out
+
+
+def combine_masks(masks):
+    """Combine binary ROI masks into one label image (mask i -> label i+1).
+
+    ``masks`` may be arrays or file paths; each is loaded once. Returns
+    ``(labels, separate)``. ``separate`` is None unless some voxel belongs
+    to more than one mask; then it holds every mask as a boolean array,
+    for per_mask_stats. Masks before the first overlap are recovered from
+    ``labels``, so they are only kept in memory when needed.
+    """
+    labels = None
+    separate = None
+    for i, m in enumerate(masks):
+        roi = np.asarray(nib.load(m).dataobj, dtype=int) != 0 if isinstance(m, str) else np.asarray(m) != 0
+        if labels is None:
+            labels = np.zeros(roi.shape, dtype=np.int32)
+        elif roi.shape != labels.shape:
+            raise ValueError(f"ROI {m if isinstance(m, str) else i} has shape {roi.shape}, expected {labels.shape}")
+        if separate is None and np.any(labels[roi] != 0):
+            separate = [labels == j + 1 for j in range(i)]
+        if separate is not None:
+            separate.append(roi)
+        labels[roi] = i + 1
+    return labels, separate
+
+
+def labels_from_masks(mask_paths):
+    """Combine binary ROI masks into one label image (mask i -> label i+1).
+
+    Returns ``(labels, overlap)`` where ``overlap`` is True if any voxel
+    belongs to more than one mask.
+    """
+    labels, separate = combine_masks(mask_paths)
+    return labels, separate is not None
+
+
+def per_mask_stats(img, masks, stats=('mean',), zooms=None):
+    """One label_stats call per boolean mask, for masks that overlap."""
+    per_mask = [label_stats(img, m.astype(np.int8), [1], stats, zooms) for m in masks]
+    return {s: np.concatenate([r[s] for r in per_mask]) for s in stats}
+
+
+def mask_stats(img, masks, stats=('mean',), zooms=None):
+    """Compute statistics of ``img`` inside each of several binary masks.
+
+    ``masks`` may be arrays or file paths. Non-overlapping masks go through
+    the single-pass label engine; overlapping masks fall back to one
+    label_stats call per mask.
+
+    Returns ``{stat: ndarray}`` aligned with ``masks``.
+    """
+    labels, separate = combine_masks(masks)
+    if separate is None:
+        return label_stats(img, labels, np.arange(1, len(masks) + 1), stats, zooms)
+    return per_mask_stats(img, separate, stats, zooms)
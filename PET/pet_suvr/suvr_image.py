@@ -0,0 +1,25 @@
+"""
+Voxelwise SUVR images: PET divided by a reference-region mean.
+
+The PET is streamed in z-slabs (see nifti_stream.py), so memory use does
+not depend on the image size. Output is float32.
+"""
+
+import numpy as np
+import nibabel as nib
+from nifti_stream import iter_slabs, SlabWriter
+
+
+def write_suvr_image(petPath, refMean, outPath, slab=16):
+    """Write ``PET / refMean`` to ``outPath`` slab by slab."""
+    if not np.isfinite(refMean) or refMean <= 0:
+        raise ValueError(f"Invalid reference mean {refMean} for {petPath}")
+    img = nib.load(petPath)
+    if int(np.prod(img.shape[3:])) != 1:
+        raise ValueError(f"{petPath} is not a 3D image (shape {img.shape})")
+    scale = np.float32(1.0 / refMean)
+    with SlabWriter(outPath, img.affine, img.header, img.shape[:3]) as w:
+        for z0, z1, block in iter_slabs(img, slab):
+            block = block.reshape(block.shape[:3]) * scale
+            w.write(block)
+    return outPath